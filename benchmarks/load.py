@@ -0,0 +1,451 @@
+"""Load benchmark for the HTTP API.
+
+Seeds a scaled dataset shaped like ``004_added_data.sql`` (N characters
+with M locations each, loaded into POSTGRES_URL with COPY, or through the
+API for ``--storage memory``), then drives every request-response route
+of ``src/routes``, the MessagePack locations page included and the live
+streams left out, in-process through ``httpx.ASGITransport`` and over the
+network against a real uvicorn instance. Latency percentiles and
+throughput are printed as JSON, so runs can be diffed between commits.
+Run with ``PYTHONPATH=. uv run python benchmarks/load.py --output
+bench.json``.
+
+With Postgres storage the database must be dedicated to benchmarks: it
+is truncated before seeding when ``--truncate`` is given and the run is
+refused otherwise if it already holds characters.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from uuid import UUID, uuid4
+
+import asyncpg
+import numpy as np
+from httpx import ASGITransport, AsyncClient, TransportError
+
+# Names and descriptions from 004_added_data.sql; generated characters get
+# a numeric suffix to keep names unique.
+NAMES = (
+    ("Фродо Бэггинс", "Хоббит-хранитель Кольца Всевластья"),
+    ("Сэмуайз Гэмджи", "Верный друг и садовник Фродо"),
+    ("Гэндальф Серый", "Могущественный маг из ордена истари"),
+    ("Арагорн", "Наследник престола Гондора, следопыт"),
+    ("Леголас", "Эльф из Лихолесья, непревзойденный лучник"),
+    ("Гимли", "Гном из Одинокой Горы, могучий воин"),
+    ("Боромир", "Сын наместника Гондора, доблестный воин"),
+    ("Саурон", "Темный Властелин Мордора"),
+    ("Голлум", "Бывший хоббит, искаженный властью Кольца"),
+    ("Галадриэль", "Владычица Лотлориэна, могущественная эльфийка"),
+)
+
+# The seed data covers roughly this map area and period.
+MAP_SIZE = 100.0
+START = datetime(2025, 8, 12, 8, tzinfo=timezone.utc)
+STEP = timedelta(minutes=10)
+
+
+@dataclass
+class Dataset:
+    character_ids: List[UUID]
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    request: Callable[[random.Random], Tuple[str, Optional[Any]]]
+    expected: int = 200
+    record: Optional[Callable[[Any], None]] = None
+    headers: Optional[Dict[str, str]] = None
+
+
+Rows = Tuple[List[tuple], List[tuple]]
+
+
+def generate(characters: int, locations: int, rng: random.Random) -> Rows:
+    character_rows = []
+    location_rows = []
+    for i in range(characters):
+        name, description = NAMES[i % len(NAMES)]
+        character_id = uuid4()
+        character_rows.append(
+            (character_id, f"{name} {i}", description, START))
+
+        x = rng.uniform(-MAP_SIZE, MAP_SIZE)
+        y = rng.uniform(-MAP_SIZE, MAP_SIZE)
+        for j in range(locations):
+            # A bounded random walk, so tracks look like the seed data.
+            x = min(max(x + rng.gauss(0, 2), -MAP_SIZE), MAP_SIZE)
+            y = min(max(y + rng.gauss(0, 2), -MAP_SIZE), MAP_SIZE)
+            location_rows.append(
+                (uuid4(), character_id, x, y, START + STEP * j))
+
+    return character_rows, location_rows
+
+
+async def seed_postgres(database_url: str, rows: Rows,
+                        truncate: bool) -> Dataset:
+    character_rows, location_rows = rows
+    conn = await asyncpg.connect(database_url)
+    try:
+        if truncate:
+            await conn.execute("TRUNCATE characters CASCADE")
+        elif await conn.fetchval("SELECT EXISTS (SELECT FROM characters)"):
+            raise SystemExit("Database is not empty, pass --truncate to "
+                             "replace its data")
+
+        await conn.copy_records_to_table(
+            "characters", records=character_rows,
+            columns=("id", "name", "description", "created_at"))
+        await conn.copy_records_to_table(
+            "locations", records=location_rows,
+            columns=("id", "character_id", "x", "y", "created_at"))
+        await conn.execute("ANALYZE characters; ANALYZE locations")
+    finally:
+        await conn.close()
+
+    return Dataset(character_ids=[row[0] for row in character_rows])
+
+
+async def seed_api(client: AsyncClient, rows: Rows) -> Dataset:
+    """Seeds the in-memory backend, which is only reachable through the
+    API. Characters get new ids from the server."""
+    character_rows, location_rows = rows
+    ids = {}
+    for id, name, description, _ in character_rows:
+        response = await client.post("/api/characters", json={
+            "name": name, "description": description})
+        ids[id] = response.json()["id"]
+
+    for offset in range(0, len(location_rows), 10000):
+        response = await client.post("/api/locations/batch", json={
+            "locations": [
+                {"character_id": ids[character_id], "x": x, "y": y,
+                 "created_at": created_at.isoformat()}
+                for _, character_id, x, y, created_at
+                in location_rows[offset:offset + 10000]]})
+        response.raise_for_status()
+
+    return Dataset(character_ids=[UUID(id) for id in ids.values()])
+
+
+def scenarios(dataset: Dataset) -> Tuple[List[Scenario], List[str]]:
+    """One scenario per route. Deletes consume the rows created for them,
+    so reads always see the seeded dataset.
+
+    Also returns the list of location ids for delete_location to consume,
+    which has to be filled before that scenario runs."""
+    created_characters: List[str] = []
+    created_locations: List[str] = []
+
+    def character(rng: random.Random) -> str:
+        return str(rng.choice(dataset.character_ids))
+
+    def now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    def point(rng: random.Random) -> Tuple[float, float]:
+        return (rng.uniform(-MAP_SIZE, MAP_SIZE),
+                rng.uniform(-MAP_SIZE, MAP_SIZE))
+
+    def create_character(_: random.Random):
+        return "/api/characters", {"name": f"Бенчмарк {uuid4()}",
+                                   "description": "Нагрузка"}
+
+    def create_location(rng: random.Random):
+        x, y = point(rng)
+        return "/api/locations", {"character_id": character(rng),
+                                  "x": x, "y": y, "created_at": now()}
+
+    def create_locations(rng: random.Random):
+        character_id = character(rng)
+        return "/api/locations/batch", {"locations": [
+            {"character_id": character_id, "x": x, "y": y,
+             "created_at": now()}
+            for x, y in (point(rng) for _ in range(100))]}
+
+    def search(rng: random.Random):
+        name, _ = rng.choice(NAMES)
+        return f"/api/characters/search?q={name[:4].lower()}", None
+
+    def characters_with_locations(rng: random.Random):
+        ids = "&".join(f"ids={character(rng)}" for _ in range(10))
+        return f"/api/characters/batch?{ids}&limit=100", None
+
+    def within(rng: random.Random):
+        x, y = point(rng)
+        return (f"/api/locations/within?x_min={x - 10}&y_min={y - 10}"
+                f"&x_max={x + 10}&y_max={y + 10}&limit=100"), None
+
+    def nearest(rng: random.Random):
+        x, y = point(rng)
+        return f"/api/locations/nearest?x={x}&y={y}&k=10", None
+
+    def update_character(rng: random.Random):
+        return f"/api/characters/{character(rng)}", {
+            "name": f"Бенчмарк {uuid4()}", "description": "Обновлен"}
+
+    def delete_character(_: random.Random):
+        return f"/api/characters/{created_characters.pop()}", None
+
+    def delete_location(_: random.Random):
+        return f"/api/locations/{created_locations.pop()}", None
+
+    return [
+        Scenario("create_character", "POST", create_character,
+                 record=lambda data: created_characters.append(data["id"])),
+        Scenario("get_character", "GET", lambda rng: (
+            f"/api/characters/{character(rng)}", None)),
+        Scenario("list_characters", "GET", lambda _: (
+            "/api/characters?limit=100", None)),
+        Scenario("get_positions", "GET", lambda _: (
+            "/api/characters/positions", None)),
+        Scenario("search_characters", "GET", search),
+        Scenario("get_character_with_locations", "GET", lambda rng: (
+            f"/api/characters/{character(rng)}?include=locations&limit=100",
+            None)),
+        Scenario("get_characters_with_locations", "GET",
+                 characters_with_locations),
+        Scenario("get_character_stats", "GET", lambda rng: (
+            f"/api/characters/{character(rng)}/stats", None)),
+        Scenario("get_characters_stats", "GET", lambda _: (
+            "/api/characters/stats?limit=100", None)),
+        Scenario("update_character", "PUT", update_character),
+        Scenario("create_location", "POST", create_location),
+        Scenario("create_locations_batch", "POST", create_locations),
+        Scenario("get_locations", "GET", lambda rng: (
+            f"/api/locations/{character(rng)}?limit=100", None)),
+        Scenario("get_locations_msgpack", "GET", lambda rng: (
+            f"/api/locations/{character(rng)}?limit=100", None),
+            headers={"Accept": "application/x-msgpack"}),
+        Scenario("get_locations_simplified", "GET", lambda rng: (
+            f"/api/locations/{character(rng)}?max_points=100", None)),
+        Scenario("get_locations_within", "GET", within),
+        Scenario("get_nearest_locations", "GET", nearest),
+        Scenario("export_locations", "GET", lambda rng: (
+            f"/api/locations/{character(rng)}/export", None)),
+        Scenario("delete_location", "DELETE", delete_location),
+        Scenario("delete_character", "DELETE", delete_character),
+    ], created_locations
+
+
+def summarize(latencies: List[float], errors: int,
+              elapsed: float) -> Dict[str, float]:
+    milliseconds = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(milliseconds, (50, 95, 99))
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(milliseconds.max()), 3),
+    }
+
+
+async def run_scenario(client: AsyncClient, scenario: Scenario,
+                       requests: int, concurrency: int,
+                       rng: random.Random) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal errors, remaining
+        while remaining > 0:
+            remaining -= 1
+            path, body = scenario.request(rng)
+            started = perf_counter()
+            if scenario.method == "GET":
+                response = await client.get(path, headers=scenario.headers)
+            else:
+                response = await client.request(
+                    scenario.method, path, json=body,
+                    headers=scenario.headers)
+            latencies.append(perf_counter() - started)
+            if response.status_code != scenario.expected:
+                errors += 1
+            elif scenario.record is not None:
+                scenario.record(response.json())
+
+    started = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, perf_counter() - started)
+
+
+async def run_all(client: AsyncClient, dataset: Dataset, requests: int,
+                  concurrency: int, warmup: int,
+                  seed_value: int) -> Dict[str, Dict[str, float]]:
+    rng = random.Random(seed_value)
+    items, created_locations = scenarios(dataset)
+    results = {}
+    for scenario in items:
+        if scenario.name == "delete_location":
+            await _create_locations(client, dataset, created_locations,
+                                    requests + warmup, rng)
+        if warmup:
+            await run_scenario(client, scenario, warmup, 1, rng)
+        results[scenario.name] = await run_scenario(
+            client, scenario, requests, concurrency, rng)
+        print(f"{client.base_url.host} {scenario.name}: "
+              f"{results[scenario.name]}", file=sys.stderr)
+    return results
+
+
+async def _create_locations(client: AsyncClient, dataset: Dataset,
+                            ids: List[str], count: int,
+                            rng: random.Random) -> None:
+    """Creates the locations consumed by delete_location."""
+    character_id = str(rng.choice(dataset.character_ids))
+    created_at = datetime.now(timezone.utc).isoformat()
+    for offset in range(0, count, 10000):
+        response = await client.post("/api/locations/batch", json={
+            "locations": [
+                {"character_id": character_id, "x": 0.0, "y": 0.0,
+                 "created_at": created_at}
+                for _ in range(min(10000, count - offset))]})
+        ids.extend(result["location"]["id"]
+                   for result in response.json()["results"])
+
+
+async def prepare(client: AsyncClient, rows: Rows,
+                  dataset: Optional[Dataset]) -> Dataset:
+    return dataset if dataset is not None else await seed_api(client, rows)
+
+
+async def bench_asgi(rows: Rows, dataset: Optional[Dataset],
+                     args: argparse.Namespace) -> Dict[str, Any]:
+    from src.main import app
+    from src.storage.backend import Storage
+
+    await Storage.connect()
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app),
+                               base_url="http://bench") as client:
+            dataset = await prepare(client, rows, dataset)
+            return await run_all(client, dataset, args.requests,
+                                 args.concurrency, args.warmup, args.seed)
+    finally:
+        await Storage.close()
+
+
+async def bench_uvicorn(rows: Rows, dataset: Optional[Dataset],
+                        args: argparse.Namespace) -> Dict[str, Any]:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app",
+         "--host", "127.0.0.1", "--port", str(args.port),
+         "--log-level", "warning", "--no-access-log"],
+        env=os.environ.copy())
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        async with AsyncClient(base_url=base_url, timeout=60) as client:
+            await _wait_ready(client, process)
+            dataset = await prepare(client, rows, dataset)
+            return await run_all(client, dataset, args.requests,
+                                 args.concurrency, args.warmup, args.seed)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+async def _wait_ready(client: AsyncClient, process: subprocess.Popen,
+                      timeout: float = 30.0) -> None:
+    deadline = perf_counter() + timeout
+    while perf_counter() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("uvicorn exited before becoming ready")
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise SystemExit("uvicorn did not become ready in time")
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+BACKENDS: Dict[str, Callable[[Rows, Optional[Dataset], argparse.Namespace],
+                             Awaitable[Dict[str, Any]]]] = {
+    "asgi": bench_asgi,
+    "uvicorn": bench_uvicorn,
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--characters", type=int, default=100)
+    parser.add_argument("--locations", type=int, default=1000,
+                        help="locations per character")
+    parser.add_argument("--requests", type=int, default=500,
+                        help="measured requests per route")
+    parser.add_argument("--warmup", type=int, default=20,
+                        help="unmeasured requests per route")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--transport", choices=(*BACKENDS, "all"),
+                        default="all")
+    parser.add_argument("--storage", choices=("postgres", "memory"),
+                        default="postgres")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--truncate", action="store_true")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    return parser.parse_args()
+
+
+async def main() -> None:
+    args = parse_args()
+    database_url = os.getenv("POSTGRES_URL")
+    if args.storage == "postgres" and not database_url:
+        raise SystemExit("POSTGRES_URL environment variable is not set")
+    # Read by the application, both in-process and in the uvicorn child.
+    os.environ["STORAGE_BACKEND"] = args.storage
+
+    report: Dict[str, Any] = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("output", "truncate")},
+        "results": {},
+    }
+    transports = list(BACKENDS) if args.transport == "all" \
+        else [args.transport]
+    for index, transport in enumerate(transports):
+        # Every transport starts from the same freshly seeded dataset.
+        rows = generate(args.characters, args.locations,
+                        random.Random(args.seed))
+        dataset = None
+        if args.storage == "postgres":
+            dataset = await seed_postgres(database_url, rows,
+                                          args.truncate or index > 0)
+        report["results"][transport] = await BACKENDS[transport](
+            rows, dataset, args)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,89 @@
+"""Per-row cost of serializing a location listing.
+
+Compares the model-based path (storage model -> response model ->
+response_model validation -> JSON) with the FastJSONResponse path used by
+the list endpoints. Run with
+``PYTHONPATH=. uv run python benchmarks/serialization.py``.
+"""
+import json
+import timeit
+from datetime import datetime, timedelta, timezone
+from typing import List
+from uuid import uuid4
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from src.dto.locations import LocationResponse, LocationsResponse
+from src.dto.responses import FastJSONResponse
+from src.storage.locations import Location
+
+SIZES = (100, 1000, 10000)
+REPEATS = 5
+
+adapter = TypeAdapter(LocationsResponse)
+
+
+def make_rows(count: int) -> List[dict]:
+    character_id = uuid4()
+    start = datetime(2025, 8, 12, tzinfo=timezone.utc)
+    return [
+        {
+            "id": uuid4(),
+            "character_id": character_id,
+            "x": i * 0.5,
+            "y": i * 0.25,
+            "created_at": start + timedelta(seconds=i),
+        }
+        for i in range(count)
+    ]
+
+
+def models(rows: List[dict]) -> bytes:
+    locations = [Location(**row) for row in rows]
+    response = LocationsResponse(
+        locations=[
+            LocationResponse(
+                id=location.id,
+                character_id=location.character_id,
+                x=location.x,
+                y=location.y,
+                created_at=location.created_at
+            ) for location in locations
+        ]
+    )
+    validated = adapter.validate_python(response, from_attributes=True)
+    content = jsonable_encoder(adapter.dump_python(validated, mode="json"))
+    return json.dumps(content, ensure_ascii=False,
+                      separators=(",", ":")).encode()
+
+
+def fast(rows: List[dict]) -> bytes:
+    return FastJSONResponse({
+        "locations": [dict(row) for row in rows],
+        "next_cursor": None
+    }).body
+
+
+def main() -> None:
+    results = []
+    for size in SIZES:
+        rows = make_rows(size)
+        assert json.loads(models(rows))["locations"] == \
+            json.loads(fast(rows))["locations"]
+
+        number = max(1, 100000 // size)
+        for name, func in (("models", models), ("fast", fast)):
+            best = min(timeit.repeat(lambda: func(rows), number=number,
+                                     repeat=REPEATS)) / number
+            results.append({
+                "path": name,
+                "rows": size,
+                "per_row_us": round(best / size * 1e6, 3),
+            })
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
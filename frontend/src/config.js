@@ -1 +1,2 @@
 export const API_URL = 'http://localhost:8000';
+export const PAGE_SIZE = 500;
@@ -0,0 +1,2 @@
+CREATE INDEX IF NOT EXISTS locations_character_id_created_at_idx
+    ON locations (character_id, created_at);
@@ -0,0 +1,4 @@
+CREATE INDEX IF NOT EXISTS locations_character_id_created_at_id_idx
+    ON locations (character_id, created_at, id);
+
+DROP INDEX IF EXISTS locations_character_id_created_at_idx;
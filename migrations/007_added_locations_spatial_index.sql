@@ -0,0 +1,2 @@
+CREATE INDEX IF NOT EXISTS locations_point_idx
+    ON locations USING gist (point(x, y));
@@ -0,0 +1,75 @@
+CREATE TABLE IF NOT EXISTS character_last_location
+(
+    character_id UUID PRIMARY KEY REFERENCES characters (id) ON DELETE CASCADE,
+    location_id  UUID        NOT NULL,
+    x            FLOAT       NOT NULL,
+    y            FLOAT       NOT NULL,
+    created_at   TIMESTAMPTZ NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION refresh_character_last_location(target UUID)
+    RETURNS VOID AS
+$$
+BEGIN
+    INSERT INTO character_last_location (character_id, location_id, x, y,
+                                         created_at)
+    SELECT character_id, id, x, y, created_at
+    FROM locations
+    WHERE character_id = target
+    ORDER BY created_at DESC, id DESC
+    LIMIT 1
+    ON CONFLICT (character_id) DO UPDATE
+        SET location_id = EXCLUDED.location_id,
+            x           = EXCLUDED.x,
+            y           = EXCLUDED.y,
+            created_at  = EXCLUDED.created_at;
+
+    IF NOT FOUND THEN
+        DELETE FROM character_last_location WHERE character_id = target;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION track_character_last_location()
+    RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND EXISTS (
+        SELECT 1
+        FROM character_last_location
+        WHERE character_id = OLD.character_id
+          AND location_id = OLD.id
+    ) THEN
+        PERFORM refresh_character_last_location(OLD.character_id);
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO character_last_location (character_id, location_id, x, y,
+                                             created_at)
+        VALUES (NEW.character_id, NEW.id, NEW.x, NEW.y, NEW.created_at)
+        ON CONFLICT (character_id) DO UPDATE
+            SET location_id = EXCLUDED.location_id,
+                x           = EXCLUDED.x,
+                y           = EXCLUDED.y,
+                created_at  = EXCLUDED.created_at
+        WHERE (character_last_location.created_at,
+               character_last_location.location_id)
+                  <= (EXCLUDED.created_at, EXCLUDED.location_id);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER locations_last_location
+    AFTER INSERT OR UPDATE OR DELETE
+    ON locations
+    FOR EACH ROW
+EXECUTE FUNCTION track_character_last_location();
+
+INSERT INTO character_last_location (character_id, location_id, x, y,
+                                     created_at)
+SELECT DISTINCT ON (character_id) character_id, id, x, y, created_at
+FROM locations
+ORDER BY character_id, created_at DESC, id DESC
+ON CONFLICT (character_id) DO NOTHING;
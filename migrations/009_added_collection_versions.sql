@@ -0,0 +1,98 @@
+CREATE SEQUENCE IF NOT EXISTS collection_version_seq;
+
+CREATE TABLE IF NOT EXISTS collection_versions
+(
+    collection TEXT PRIMARY KEY,
+    version    BIGINT      NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION bump_collection_versions(collections TEXT[])
+    RETURNS VOID AS
+$$
+INSERT INTO collection_versions (collection, version, updated_at)
+SELECT collection, nextval('collection_version_seq'), now()
+FROM (SELECT DISTINCT unnest(collections) AS collection) AS bumped
+ORDER BY collection
+ON CONFLICT (collection) DO UPDATE
+    SET version    = EXCLUDED.version,
+        updated_at = EXCLUDED.updated_at;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION bump_characters_version()
+    RETURNS TRIGGER AS
+$$
+BEGIN
+    PERFORM bump_collection_versions(ARRAY ['characters']);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bump_locations_versions()
+    RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE collection_versions
+        SET version    = nextval('collection_version_seq'),
+            updated_at = now()
+        WHERE collection LIKE 'locations:%';
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM bump_collection_versions(
+                ARRAY(SELECT 'locations:' || character_id FROM new_rows));
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM bump_collection_versions(
+                ARRAY(SELECT 'locations:' || character_id FROM old_rows));
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        -- Deleted characters (the cascade ends here) need no version.
+        DELETE
+        FROM collection_versions
+        WHERE collection IN (SELECT 'locations:' || character_id
+                             FROM old_rows
+                             WHERE NOT EXISTS (SELECT
+                                               FROM characters
+                                               WHERE id = character_id));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level triggers, so a COPY or a cascade delete bumps each
+-- collection once.
+CREATE OR REPLACE TRIGGER characters_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+    ON characters
+    FOR EACH STATEMENT
+EXECUTE FUNCTION bump_characters_version();
+
+CREATE OR REPLACE TRIGGER locations_version_insert
+    AFTER INSERT
+    ON locations
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+EXECUTE FUNCTION bump_locations_versions();
+
+CREATE OR REPLACE TRIGGER locations_version_update
+    AFTER UPDATE
+    ON locations
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+EXECUTE FUNCTION bump_locations_versions();
+
+CREATE OR REPLACE TRIGGER locations_version_delete
+    AFTER DELETE
+    ON locations
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+EXECUTE FUNCTION bump_locations_versions();
+
+CREATE OR REPLACE TRIGGER locations_version_truncate
+    AFTER TRUNCATE
+    ON locations
+    FOR EACH STATEMENT
+EXECUTE FUNCTION bump_locations_versions();
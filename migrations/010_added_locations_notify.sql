@@ -0,0 +1,23 @@
+CREATE OR REPLACE FUNCTION notify_locations()
+    RETURNS TRIGGER AS
+$$
+BEGIN
+    -- Delivered to listeners when the inserting transaction commits.
+    PERFORM pg_notify('locations',
+                      json_build_object('id', id,
+                                        'character_id', character_id,
+                                        'x', x,
+                                        'y', y,
+                                        'created_at', created_at)::text)
+    FROM new_rows
+    ORDER BY created_at, id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER locations_notify
+    AFTER INSERT
+    ON locations
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+EXECUTE FUNCTION notify_locations();
@@ -0,0 +1,169 @@
+-- Turns locations into a table partitioned by month of created_at (UTC).
+-- Partitions are named locations_pYYYY_MM, rows outside of them land in
+-- locations_default. The primary key has to include the partition key,
+-- ids stay unique as they are random UUIDs.
+
+ALTER TABLE locations
+    RENAME TO locations_unpartitioned;
+
+CREATE TABLE locations
+(
+    id           UUID        NOT NULL,
+    character_id UUID        NOT NULL REFERENCES characters (id) ON DELETE CASCADE,
+    x            FLOAT       NOT NULL,
+    y            FLOAT       NOT NULL,
+    created_at   TIMESTAMPTZ NOT NULL
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE locations_default PARTITION OF locations DEFAULT;
+
+CREATE OR REPLACE FUNCTION create_locations_partition(month TIMESTAMPTZ)
+    RETURNS BOOLEAN AS
+$$
+DECLARE
+    local_start TIMESTAMP := date_trunc('month', month AT TIME ZONE 'UTC');
+    start       TIMESTAMPTZ := local_start AT TIME ZONE 'UTC';
+    stop        TIMESTAMPTZ := (local_start + INTERVAL '1 month') AT TIME ZONE 'UTC';
+    name        TEXT := 'locations_p' || to_char(local_start, 'YYYY_MM');
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('locations_partitions'));
+    IF to_regclass(name) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+
+    -- Created standalone and attached, which only takes a SHARE UPDATE
+    -- EXCLUSIVE lock on locations. Rows of the month that went to the
+    -- default partition are moved first, as the attach would fail.
+    EXECUTE format('CREATE TABLE %I (LIKE locations INCLUDING ALL)',
+                   name);
+    EXECUTE format('WITH moved AS (DELETE FROM locations_default '
+                       'WHERE created_at >= $1 AND created_at < $2 '
+                       'RETURNING *) '
+                       'INSERT INTO %I SELECT * FROM moved', name)
+        USING start, stop;
+    EXECUTE format('ALTER TABLE locations ATTACH PARTITION %I '
+                       'FOR VALUES FROM (%L) TO (%L)', name, start, stop);
+
+    -- The move fired the last location trigger of the default partition.
+    EXECUTE format('SELECT refresh_character_last_location(character_id) '
+                       'FROM (SELECT DISTINCT character_id FROM %I) moved',
+                   name);
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION ensure_locations_partitions(ahead INT)
+    RETURNS INT AS
+$$
+SELECT count(*)::INT
+FROM generate_series(date_trunc('month', now() AT TIME ZONE 'UTC'),
+                     date_trunc('month', now() AT TIME ZONE 'UTC')
+                         + make_interval(months => ahead),
+                     INTERVAL '1 month') AS month
+WHERE create_locations_partition(month AT TIME ZONE 'UTC');
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION drop_locations_partitions(before TIMESTAMPTZ,
+                                                     archive BOOLEAN DEFAULT FALSE)
+    RETURNS INT AS
+$$
+DECLARE
+    name    TEXT;
+    dropped INT := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('locations_partitions'));
+
+    -- Whole months older than before go at once, without row triggers.
+    FOR name IN
+        SELECT child.relname
+        FROM pg_inherits
+                 JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = 'locations'::regclass
+          AND child.relname ~ '^locations_p\d{4}_\d{2}$'
+          AND (to_date(substr(child.relname, 12), 'YYYY_MM')
+                   + INTERVAL '1 month') AT TIME ZONE 'UTC' <= before
+        ORDER BY child.relname
+        LOOP
+            EXECUTE format('SELECT bump_collection_versions(ARRAY('
+                               'SELECT DISTINCT ''locations:'' || character_id '
+                               'FROM %I))', name);
+            EXECUTE format('ALTER TABLE locations DETACH PARTITION %I',
+                           name);
+            IF NOT archive THEN
+                EXECUTE format('DROP TABLE %I', name);
+            END IF;
+            dropped := dropped + 1;
+        END LOOP;
+
+    -- The rest is only in the default partition, through the triggers.
+    DELETE FROM locations WHERE created_at < before;
+
+    -- A last location older than before has no newer one left.
+    DELETE FROM character_last_location WHERE created_at < before;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A partition for every month with data and the next three.
+SELECT count(*)
+FROM generate_series(
+             coalesce((SELECT date_trunc('month', min(created_at) AT TIME ZONE 'UTC')
+                       FROM locations_unpartitioned),
+                      date_trunc('month', now() AT TIME ZONE 'UTC')),
+             date_trunc('month', now() AT TIME ZONE 'UTC') + INTERVAL '3 months',
+             INTERVAL '1 month') AS month
+WHERE create_locations_partition(month AT TIME ZONE 'UTC');
+
+INSERT INTO locations (id, character_id, x, y, created_at)
+SELECT id, character_id, x, y, created_at
+FROM locations_unpartitioned;
+
+DROP TABLE locations_unpartitioned;
+
+-- Indexes and triggers of 003-010, created on every partition.
+ALTER TABLE locations
+    ADD PRIMARY KEY (id, created_at);
+CREATE INDEX IF NOT EXISTS locations_character_id_created_at_id_idx
+    ON locations (character_id, created_at, id);
+CREATE INDEX IF NOT EXISTS locations_point_idx
+    ON locations USING gist (point(x, y));
+
+CREATE OR REPLACE TRIGGER locations_last_location
+    AFTER INSERT OR UPDATE OR DELETE
+    ON locations
+    FOR EACH ROW
+EXECUTE FUNCTION track_character_last_location();
+
+CREATE OR REPLACE TRIGGER locations_version_insert
+    AFTER INSERT
+    ON locations
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+EXECUTE FUNCTION bump_locations_versions();
+
+CREATE OR REPLACE TRIGGER locations_version_update
+    AFTER UPDATE
+    ON locations
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+EXECUTE FUNCTION bump_locations_versions();
+
+CREATE OR REPLACE TRIGGER locations_version_delete
+    AFTER DELETE
+    ON locations
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+EXECUTE FUNCTION bump_locations_versions();
+
+CREATE OR REPLACE TRIGGER locations_version_truncate
+    AFTER TRUNCATE
+    ON locations
+    FOR EACH STATEMENT
+EXECUTE FUNCTION bump_locations_versions();
+
+CREATE OR REPLACE TRIGGER locations_notify
+    AFTER INSERT
+    ON locations
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+EXECUTE FUNCTION notify_locations();
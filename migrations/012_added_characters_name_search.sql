@@ -0,0 +1,19 @@
+-- Prefix search: text_pattern_ops compares bytes, so ranges of lower(name)
+-- are indexable in any collation.
+CREATE INDEX IF NOT EXISTS characters_name_prefix_idx
+    ON characters (lower(name) text_pattern_ops);
+
+-- Typo-tolerant search. pg_trgm ships with the official images; without
+-- it the search stays prefix only.
+DO
+$$
+BEGIN
+    IF EXISTS (SELECT FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS characters_name_trgm_idx
+            ON characters USING gin (lower(name) gin_trgm_ops);
+    ELSE
+        RAISE WARNING 'pg_trgm is not available, character search is prefix only';
+    END IF;
+END;
+$$;
@@ -0,0 +1,32 @@
+CREATE OR REPLACE FUNCTION notify_characters()
+    RETURNS TRIGGER AS
+$$
+BEGIN
+    -- Server workers drop the changed characters from their caches when
+    -- the transaction commits. A payload is limited to 8000 bytes, so
+    -- larger statements clear the whole cache.
+    PERFORM pg_notify('characters',
+                      CASE
+                          WHEN count(*) > 200 THEN '*'
+                          ELSE string_agg(id::text, ',')
+                      END)
+    FROM old_rows
+    HAVING count(*) > 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Triggers with transition tables take a single event each.
+CREATE OR REPLACE TRIGGER characters_notify_update
+    AFTER UPDATE
+    ON characters
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+EXECUTE FUNCTION notify_characters();
+
+CREATE OR REPLACE TRIGGER characters_notify_delete
+    AFTER DELETE
+    ON characters
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+EXECUTE FUNCTION notify_characters();
@@ -0,0 +1,22 @@
+CREATE OR REPLACE FUNCTION notify_locations()
+    RETURNS TRIGGER AS
+$$
+BEGIN
+    -- One notification per 30 locations instead of one per location: every
+    -- notification takes the queue lock at commit, which made large COPYs
+    -- crawl. 30 rows stay well below the 8000-byte payload limit.
+    PERFORM pg_notify('locations', json_agg(row ORDER BY n)::text)
+    FROM (SELECT (n - 1) / 30                              AS batch,
+                 n,
+                 json_build_object('id', id,
+                                   'character_id', character_id,
+                                   'x', x,
+                                   'y', y,
+                                   'created_at', created_at) AS row
+          FROM (SELECT *, row_number() OVER (ORDER BY created_at, id) AS n
+                FROM new_rows) numbered) batched
+    GROUP BY batch
+    ORDER BY batch;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
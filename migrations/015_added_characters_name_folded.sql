@@ -0,0 +1,49 @@
+-- lower() folds by the database ctype and leaves Cyrillic as is under C, so
+-- the server stores names lower-cased by Python and searches those.
+ALTER TABLE characters
+    ADD COLUMN IF NOT EXISTS name_folded TEXT;
+
+DO
+$$
+BEGIN
+    IF EXISTS (SELECT
+               FROM pg_collation
+               WHERE collname = 'und-x-icu'
+                 AND collencoding IN (-1, pg_char_to_encoding(
+                       getdatabaseencoding()))) THEN
+        UPDATE characters
+        SET name_folded = lower(name COLLATE "und-x-icu")
+        WHERE name_folded IS NULL;
+    ELSIF getdatabaseencoding() = 'UTF8' THEN
+        -- Without ICU at least the Russian alphabet is folded.
+        UPDATE characters
+        SET name_folded = translate(lower(name),
+                                    'АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ',
+                                    'абвгдеёжзийклмнопрстуфхцчшщъыьэюя')
+        WHERE name_folded IS NULL;
+    ELSE
+        RAISE WARNING 'ICU is not available, existing names are folded by the database ctype';
+        UPDATE characters
+        SET name_folded = lower(name)
+        WHERE name_folded IS NULL;
+    END IF;
+END;
+$$;
+
+ALTER TABLE characters
+    ALTER COLUMN name_folded SET NOT NULL;
+
+DROP INDEX IF EXISTS characters_name_prefix_idx;
+CREATE INDEX IF NOT EXISTS characters_name_folded_prefix_idx
+    ON characters (name_folded text_pattern_ops);
+
+DO
+$$
+BEGIN
+    IF EXISTS (SELECT FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        DROP INDEX IF EXISTS characters_name_trgm_idx;
+        CREATE INDEX characters_name_trgm_idx
+            ON characters USING gin (name_folded gin_trgm_ops);
+    END IF;
+END;
+$$;
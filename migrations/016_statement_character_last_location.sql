@@ -0,0 +1,59 @@
+-- The row trigger of 008 upserted the same character_last_location row
+-- once per inserted location, so COPY batches paid one upsert per row.
+-- Statement triggers upsert once per character from the transition tables.
+DROP TRIGGER IF EXISTS locations_last_location ON locations;
+
+CREATE OR REPLACE FUNCTION track_character_last_location()
+    RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM refresh_character_last_location(character_id)
+        FROM (SELECT DISTINCT old_rows.character_id
+              FROM old_rows
+                       JOIN character_last_location stored
+                            ON stored.character_id = old_rows.character_id
+                                AND stored.location_id = old_rows.id) changed;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO character_last_location (character_id, location_id, x, y,
+                                             created_at)
+        SELECT DISTINCT ON (character_id) character_id, id, x, y, created_at
+        FROM new_rows
+        ORDER BY character_id, created_at DESC, id DESC
+        ON CONFLICT (character_id) DO UPDATE
+            SET location_id = EXCLUDED.location_id,
+                x           = EXCLUDED.x,
+                y           = EXCLUDED.y,
+                created_at  = EXCLUDED.created_at
+        WHERE (character_last_location.created_at,
+               character_last_location.location_id)
+                  <= (EXCLUDED.created_at, EXCLUDED.location_id);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Triggers with transition tables take a single event each.
+CREATE OR REPLACE TRIGGER locations_last_location_insert
+    AFTER INSERT
+    ON locations
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+EXECUTE FUNCTION track_character_last_location();
+
+CREATE OR REPLACE TRIGGER locations_last_location_update
+    AFTER UPDATE
+    ON locations
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+EXECUTE FUNCTION track_character_last_location();
+
+CREATE OR REPLACE TRIGGER locations_last_location_delete
+    AFTER DELETE
+    ON locations
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+EXECUTE FUNCTION track_character_last_location();
@@ -0,0 +1,48 @@
+-- name_folded was filled by the server only, so raw inserts failed on NOT
+-- NULL and raw renames left it stale. It is now generated from name by
+-- fold_name(), which lower-cases under ICU whatever the database ctype.
+DO
+$$
+BEGIN
+    IF EXISTS (SELECT
+               FROM pg_collation
+               WHERE collname = 'und-x-icu'
+                 AND collencoding IN (-1, pg_char_to_encoding(
+                       getdatabaseencoding()))) THEN
+        CREATE OR REPLACE FUNCTION fold_name(name TEXT)
+            RETURNS TEXT
+            IMMUTABLE PARALLEL SAFE
+            LANGUAGE sql
+        AS 'SELECT lower(name COLLATE "und-x-icu")';
+    ELSE
+        -- Without ICU at least the Russian alphabet is folded.
+        RAISE WARNING 'ICU is not available, only Latin and Cyrillic names are folded';
+        CREATE OR REPLACE FUNCTION fold_name(name TEXT)
+            RETURNS TEXT
+            IMMUTABLE PARALLEL SAFE
+            LANGUAGE sql
+        AS 'SELECT translate(lower(name),
+                             ''АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ'',
+                             ''абвгдеёжзийклмнопрстуфхцчшщъыьэюя'')';
+    END IF;
+END;
+$$;
+
+-- Dropping the column drops its indexes too.
+ALTER TABLE characters
+    DROP COLUMN IF EXISTS name_folded;
+ALTER TABLE characters
+    ADD COLUMN name_folded TEXT GENERATED ALWAYS AS (fold_name(name)) STORED;
+
+CREATE INDEX IF NOT EXISTS characters_name_folded_prefix_idx
+    ON characters (name_folded text_pattern_ops);
+
+DO
+$$
+BEGIN
+    IF EXISTS (SELECT FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        CREATE INDEX IF NOT EXISTS characters_name_trgm_idx
+            ON characters USING gin (name_folded gin_trgm_ops);
+    END IF;
+END;
+$$;
@@ -0,0 +1,4 @@
+-- Characters are listed by name byte-wise (COLLATE "C"), the order the
+-- in-memory backend uses too, whatever the database collation.
+CREATE INDEX IF NOT EXISTS characters_name_c_idx
+    ON characters (name COLLATE "C", id);
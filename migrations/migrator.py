@@ -1,9 +1,55 @@
 import asyncio
+import csv
+import hashlib
 import os
 from pathlib import Path
+from time import perf_counter
+from typing import List, Optional, Tuple
 
 import asyncpg
 
+# Data migrations are named NNN_description.<table>.csv (with a header row
+# naming the columns) or NNN_description.<table>.bin (binary COPY of every
+# column) and are streamed into the table with COPY.
+DATA_FORMATS = {".csv": "csv", ".bin": "binary"}
+
+CHUNK_SIZE = 1 << 20
+
+
+def checksum(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as file:
+        while chunk := file.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def data_target(path: Path) -> Tuple[str, str, Optional[List[str]]]:
+    """Table, COPY format and columns of a data migration."""
+    table = Path(path.stem).suffix.lstrip(".")
+    if not table:
+        raise RuntimeError(f"Data migration {path.name} does not name "
+                           "its table, expected NNN_name.<table>"
+                           f"{path.suffix}")
+
+    columns = None
+    if path.suffix == ".csv":
+        with path.open(newline="", encoding="utf-8") as file:
+            columns = next(csv.reader(file))
+    return table, DATA_FORMATS[path.suffix], columns
+
+
+async def apply(conn: asyncpg.Connection, path: Path) -> None:
+    if path.suffix == ".sql":
+        await conn.execute(path.read_text())
+        return
+
+    table, copy_format, columns = data_target(path)
+    # asyncpg reads the file in chunks, it is never loaded whole.
+    await conn.copy_to_table(table, source=path, columns=columns,
+                             format=copy_format,
+                             header=copy_format == "csv")
+
 
 async def main():
     dsn = os.getenv("POSTGRES_URL")
@@ -16,22 +62,32 @@ async def main():
         dsn, statement_cache_size=0,
         max_cacheable_statement_size=0)
     try:
+        # Held until the connection closes, so concurrent migrators apply
+        # the files one after another and skip what the first one applied.
+        print("Waiting for the migrations lock")
+        await conn.execute("SELECT pg_advisory_lock(hashtext('migrations'))")
+
         await conn.execute(
             """
             CREATE TABLE IF NOT EXISTS migrations
             (
                 id   SERIAL PRIMARY KEY,
                 name TEXT NOT NULL
-            )""")
+            );
+            ALTER TABLE migrations
+                ADD COLUMN IF NOT EXISTS checksum    TEXT,
+                ADD COLUMN IF NOT EXISTS duration_ms DOUBLE PRECISION,
+                ADD COLUMN IF NOT EXISTS applied_at  TIMESTAMPTZ""")
 
-        applied = set()
-        rows = await conn.fetch("SELECT name FROM migrations")
+        applied = {}
+        rows = await conn.fetch("SELECT name, checksum FROM migrations")
         for row in rows:
-            applied.add(row["name"])
+            applied[row["name"]] = row["checksum"]
 
         files = sorted([
             f.name for f in Path(migrations_dir).iterdir()
-            if f.suffix == ".sql" and f.is_file()
+            if (f.suffix == ".sql" or f.suffix in DATA_FORMATS)
+            and f.is_file()
         ])
 
         if not files:
@@ -39,21 +95,34 @@ async def main():
             return
 
         for file in files:
+            filepath = Path(migrations_dir) / file
+            file_checksum = checksum(filepath)
+
             if file in applied:
+                if applied[file] is None:
+                    await conn.execute(
+                        "UPDATE migrations SET checksum = $1 "
+                        "WHERE name = $2", file_checksum, file)
+                elif applied[file] != file_checksum:
+                    print(f"Warning: migration {file} has changed "
+                          "since it was applied")
                 print(f"Migration {file} have already been applied")
                 continue
 
             print(f"Applying {file} migration")
-            filepath = Path(migrations_dir) / file
-            sql = filepath.read_text()
+            started = perf_counter()
 
             async with conn.transaction():
                 try:
-                    await conn.execute(sql)
+                    await apply(conn, filepath)
+                    duration_ms = (perf_counter() - started) * 1000
                     await conn.execute(
-                        "INSERT INTO migrations (name) VALUES ($1)", file
-                    )
-                    print(f"Migration {file} applied")
+                        "INSERT INTO migrations (name, checksum, "
+                        "duration_ms, applied_at) "
+                        "VALUES ($1, $2, $3, now())",
+                        file, file_checksum, duration_ms)
+                    print(f"Migration {file} applied "
+                          f"in {duration_ms:.0f} ms")
                 except Exception as e:
                     raise RuntimeError(f"Failed to apply {file}: {e}")
 
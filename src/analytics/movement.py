@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+import numpy as np
+
+from src.storage.base import Row
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+_UNITS = {"hour": "h", "day": "D", "month": "M"}
+
+
+def _truncate(times: np.ndarray, bucket: str) -> np.ndarray:
+    """Bucket starts of UTC times, like date_trunc(bucket, t, 'UTC')."""
+    if bucket == "week":
+        # 1970-01-01 was a Thursday, weeks start on Monday.
+        days = times.astype("datetime64[D]").astype(np.int64)
+        return ((days + 3) // 7 * 7 - 3).astype("datetime64[D]")
+    return times.astype(f"datetime64[{_UNITS[bucket]}]")
+
+
+def _datetime(value: np.datetime64) -> datetime:
+    return _EPOCH + int(value.astype("datetime64[us]").astype(np.int64)) \
+        * _MICROSECOND
+
+
+def movement_stats(rows: List[Row], bucket: str) -> Dict[str, Any]:
+    """Distance, speeds, bounding box and points per bucket of a track
+    sorted by time. A step counts towards the bucket of the point it ends
+    at, speeds are in coordinate units per second."""
+    x = np.fromiter((row["x"] for row in rows), float, len(rows))
+    y = np.fromiter((row["y"] for row in rows), float, len(rows))
+    times = np.fromiter(
+        ((row["created_at"] - _EPOCH) // _MICROSECOND for row in rows),
+        np.int64, len(rows)).astype("datetime64[us]")
+
+    steps = np.hypot(np.diff(x), np.diff(y))
+    seconds = np.diff(times).astype(np.int64) / 1e6
+    moving = seconds > 0
+    distance = float(steps.sum())
+    duration = int((times[-1] - times[0]).astype(np.int64)) / 1e6
+
+    starts, first, counts = np.unique(_truncate(times, bucket),
+                                      return_index=True, return_counts=True)
+    distances = np.add.reduceat(np.concatenate(([0.0], steps)), first)
+
+    return {
+        "points": len(rows),
+        "distance": distance,
+        "average_speed": distance / duration if duration > 0 else None,
+        "max_speed": float(np.max(steps[moving] / seconds[moving]))
+        if moving.any() else None,
+        "x_min": float(x.min()),
+        "y_min": float(y.min()),
+        "x_max": float(x.max()),
+        "y_max": float(y.max()),
+        "first_at": rows[0]["created_at"],
+        "last_at": rows[-1]["created_at"],
+        "buckets": [
+            {"start": _datetime(start), "points": int(count),
+             "distance": float(bucket_distance)}
+            for start, count, bucket_distance in zip(starts, counts,
+                                                     distances)
+        ],
+    }
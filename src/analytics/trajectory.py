@@ -0,0 +1,61 @@
+import heapq
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+def _farthest(x: np.ndarray, y: np.ndarray,
+              first: int, last: int) -> Tuple[int, float]:
+    px = x[first + 1:last] - x[first]
+    py = y[first + 1:last] - y[first]
+    dx = x[last] - x[first]
+    dy = y[last] - y[first]
+
+    norm = np.hypot(dx, dy)
+    if norm == 0:
+        distances = np.hypot(px, py)
+    else:
+        distances = np.abs(dy * px - dx * py) / norm
+
+    index = int(np.argmax(distances))
+    return first + 1 + index, float(distances[index])
+
+
+def simplify(x: np.ndarray, y: np.ndarray,
+             max_points: Optional[int] = None,
+             tolerance: Optional[float] = None) -> np.ndarray:
+    """Douglas–Peucker simplification of a track.
+
+    Segments are split in order of their largest deviation, so the result
+    is the best ``max_points`` approximation and/or stops once every
+    dropped point lies within ``tolerance`` of the kept polyline. Returns
+    sorted indices of the kept points.
+    """
+    n = len(x)
+    if n <= 2 or (tolerance is None and
+                  (max_points is None or n <= max_points)):
+        return np.arange(n)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    kept = 2
+
+    heap: List[Tuple[float, int, int, int]] = []
+
+    def split(first: int, last: int) -> None:
+        if last - first > 1:
+            index, distance = _farthest(x, y, first, last)
+            heapq.heappush(heap, (-distance, first, last, index))
+
+    split(0, n - 1)
+    while heap and (max_points is None or kept < max_points):
+        distance, first, last, index = heapq.heappop(heap)
+        if tolerance is not None and -distance <= tolerance:
+            break
+
+        keep[index] = True
+        kept += 1
+        split(first, index)
+        split(index, last)
+
+    return np.flatnonzero(keep)
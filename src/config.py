@@ -0,0 +1,11 @@
+import os
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+
+def env(name: str, default: T, cast: Callable[[str], T]) -> T:
+    """The variable cast to the type of default; unset or empty gives
+    default."""
+    value = os.getenv(name)
+    return cast(value) if value else default
@@ -1,37 +1,354 @@
+import asyncio
 import logging
 import os
-from typing import Optional
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import wraps
+from time import monotonic, perf_counter
+from typing import (Any, AsyncIterator, Awaitable, Callable, Dict, Optional,
+                    TypeVar)
 
 import asyncpg
-from asyncpg import Pool
+from asyncpg import Connection, Pool
+
+from src.config import env
+from src.monitoring.metrics import Counter, Gauge, Histogram
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Set once a request has written to the primary, so that its later reads
+# see their own writes instead of a possibly lagging replica.
+_wrote_to_primary: ContextVar[bool] = ContextVar("wrote_to_primary",
+                                                 default=False)
+
+_REPLICA_RETRY_INTERVAL = 5.0
+_LISTENER_RETRY_INTERVAL = 1.0
+_REPLICA_ERRORS = (OSError, asyncio.TimeoutError,
+                   asyncpg.PostgresConnectionError, asyncpg.InterfaceError)
+
+
+class ReplicaUnavailable(Exception):
+    """A read lost its replica connection or timed out on it."""
+
+
+def retry_on_primary(func: Callable[..., Awaitable[T]]
+                     ) -> Callable[..., Awaitable[T]]:
+    """Runs a read again, on the primary, if the replica fails under it.
+
+    Only for reads that can be repeated as a whole; the replica is then
+    skipped for _REPLICA_RETRY_INTERVAL."""
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs) -> T:
+        try:
+            return await func(*args, **kwargs)
+        except ReplicaUnavailable:
+            return await func(*args, **kwargs)
+
+    return wrapper
+
 
 class Postgres:
+    _url: Optional[str] = None
     _pool: Optional[Pool] = None
+    _replica: Optional[Pool] = None
+    _replica_url: Optional[str] = None
+    _replica_settings: Dict[str, Any] = {}
+    _replica_task: Optional[asyncio.Task] = None
+    _listener: Optional[Connection] = None
+    _listener_task: Optional[asyncio.Task] = None
+    _channels: Dict[str, Callable[[str], None]] = {}
+    _resets: Dict[str, Callable[[], None]] = {}
+    _replica_retry_at = 0.0
+    _acquire_timeout: Optional[float] = None
+
+    _acquires = 0
+    _waiting = 0
+    _timeouts = 0
+    _wait_total = 0.0
+    _wait_max = 0.0
 
     @staticmethod
-    async def connect() -> None:
+    async def connect(
+            init: Optional[Callable[[Connection], Awaitable[None]]] = None
+    ) -> None:
         database_url = os.getenv("POSTGRES_URL")
         if not database_url:
             raise ValueError("POSTGRES_URL environment "
                              "variable is not set")
 
+        Postgres._url = database_url
+        Postgres._acquire_timeout = env(
+            "POSTGRES_ACQUIRE_TIMEOUT", 10.0, float)
+
+        settings = dict(
+            min_size=env("POSTGRES_POOL_MIN_SIZE", 1, int),
+            max_size=env("POSTGRES_POOL_MAX_SIZE", 10, int),
+            max_queries=env("POSTGRES_POOL_MAX_QUERIES", 50000, int),
+            max_inactive_connection_lifetime=env(
+                "POSTGRES_POOL_MAX_INACTIVE_LIFETIME", 300.0, float),
+            statement_cache_size=env(
+                "POSTGRES_STATEMENT_CACHE_SIZE", 100, int),
+            command_timeout=env("POSTGRES_COMMAND_TIMEOUT", None, float),
+            init=init)
+
         try:
+            # The pool opens min_size connections before returning, so the
+            # application starts with a warm pool.
             # noinspection PyUnresolvedReferences
             Postgres._pool = await asyncpg.create_pool(
-                database_url, min_size=1, max_size=10)
+                database_url, **settings)
             logger.info("Postgres connection pool created successfully")
         except Exception as e:
             logger.error(f"Failed to create postgres pool: {e}")
             raise
 
+        Postgres._replica_url = os.getenv("POSTGRES_REPLICA_URL") or None
+        Postgres._replica_retry_at = 0.0
+        # A hung replica must not block reads that the primary can serve.
+        Postgres._replica_settings = dict(
+            settings, command_timeout=env(
+                "POSTGRES_REPLICA_COMMAND_TIMEOUT", 30.0, float))
+        if Postgres._replica_url is not None:
+            await Postgres._connect_replica()
+
+    @staticmethod
+    async def _connect_replica() -> None:
+        try:
+            # noinspection PyUnresolvedReferences
+            Postgres._replica = await asyncpg.create_pool(
+                Postgres._replica_url, **Postgres._replica_settings)
+            Postgres._replica_retry_at = 0.0
+            logger.info("Postgres replica pool created successfully")
+        except Exception as e:
+            logger.warning(f"Failed to create postgres replica pool, "
+                           f"reading from primary: {e}")
+            Postgres._replica_retry_at = (monotonic()
+                                          + _REPLICA_RETRY_INTERVAL)
+
+    @staticmethod
+    def _replica_failed(error: BaseException) -> None:
+        logger.warning(f"Postgres replica is unavailable, "
+                       f"reading from primary: {error}")
+        Postgres._replica_retry_at = monotonic() + _REPLICA_RETRY_INTERVAL
+
+    @staticmethod
+    @asynccontextmanager
+    async def acquire(readonly: bool = False,
+                      replica: bool = True) -> AsyncIterator[Connection]:
+        """Connection to the primary, or for readonly to the replica if it
+        is up. replica=False keeps a read on the primary, for rows that are
+        cached across requests and must not be refilled from a lagging
+        replica."""
+        pool = Postgres._pool
+        if not readonly:
+            _wrote_to_primary.set(True)
+        elif (replica and not _wrote_to_primary.get()
+              and monotonic() >= Postgres._replica_retry_at):
+            if Postgres._replica is not None:
+                pool = Postgres._replica
+            elif Postgres._replica_url is not None:
+                # The replica was down at startup: this read goes to the
+                # primary while the pool is created in the background.
+                Postgres._replica_retry_at = (monotonic()
+                                              + _REPLICA_RETRY_INTERVAL)
+                Postgres._replica_task = asyncio.create_task(
+                    Postgres._connect_replica())
+
+        try:
+            conn = await Postgres._acquire(pool)
+        except _REPLICA_ERRORS as e:
+            if pool is Postgres._pool:
+                raise
+            Postgres._replica_failed(e)
+            pool = Postgres._pool
+            conn = await Postgres._acquire(pool)
+
+        try:
+            yield conn
+        except _REPLICA_ERRORS as e:
+            if pool is Postgres._pool:
+                raise
+            # Lost or timed out mid-query: retry_on_primary runs it again.
+            Postgres._replica_failed(e)
+            raise ReplicaUnavailable() from e
+        finally:
+            await pool.release(conn)
+
+    @staticmethod
+    async def _acquire(pool: Pool) -> Connection:
+        started = perf_counter()
+        Postgres._waiting += 1
+        try:
+            conn = await pool.acquire(timeout=Postgres._acquire_timeout)
+        except asyncio.TimeoutError:
+            Postgres._timeouts += 1
+            raise
+        finally:
+            Postgres._waiting -= 1
+
+        waited = perf_counter() - started
+        Postgres._acquires += 1
+        Postgres._wait_total += waited
+        Postgres._wait_max = max(Postgres._wait_max, waited)
+        ACQUIRE_WAIT.observe(waited)
+        return conn
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        pool = Postgres._pool
+        if pool is None:
+            return {}
+
+        size = pool.get_size()
+        idle = pool.get_idle_size()
+        stats = {
+            "min_size": pool.get_min_size(),
+            "max_size": pool.get_max_size(),
+            "size": size,
+            "idle": idle,
+            "in_use": size - idle,
+            "waiting": Postgres._waiting,
+            "acquires": Postgres._acquires,
+            "acquire_timeouts": Postgres._timeouts,
+            "acquire_wait_avg": (Postgres._wait_total / Postgres._acquires
+                                 if Postgres._acquires else 0.0),
+            "acquire_wait_max": Postgres._wait_max,
+        }
+
+        replica = Postgres._replica
+        if replica is not None:
+            stats["replica"] = {
+                "size": replica.get_size(),
+                "idle": replica.get_idle_size(),
+                "in_use": replica.get_size() - replica.get_idle_size(),
+                "available": monotonic() >= Postgres._replica_retry_at,
+            }
+
+        return stats
+
+    @staticmethod
+    async def is_ready(timeout: float = 1.0) -> bool:
+        pool = Postgres._pool
+        if pool is None or pool.is_closing():
+            return False
+
+        try:
+            async with pool.acquire(timeout=timeout) as conn:
+                await conn.fetchval("SELECT 1", timeout=timeout)
+        except (asyncio.TimeoutError, OSError, asyncpg.PostgresError) as e:
+            logger.warning(f"Postgres is not ready: {e}")
+            return False
+
+        return True
+
+    @staticmethod
+    async def listen(channel: str, callback: Callable[[str], None],
+                     reset: Optional[Callable[[], None]] = None) -> None:
+        """Calls callback with the payload of every NOTIFY on channel.
+
+        All channels share one dedicated connection to the primary, which
+        is re-established in the background if it drops. Notifications
+        sent while it is down are lost; reset is called once it is back.
+        """
+        Postgres._channels[channel] = callback
+        if reset is not None:
+            Postgres._resets[channel] = reset
+        if Postgres._listener is None:
+            await Postgres._connect_listener()
+        else:
+            await Postgres._listener.add_listener(channel, Postgres._notify)
+
+    @staticmethod
+    async def _connect_listener() -> None:
+        conn = await asyncpg.connect(Postgres._url)
+        for channel in Postgres._channels:
+            await conn.add_listener(channel, Postgres._notify)
+        conn.add_termination_listener(Postgres._listener_lost)
+        Postgres._listener = conn
+
+    @staticmethod
+    def _notify(_: Connection, __: int, channel: str, payload: str) -> None:
+        callback = Postgres._channels.get(channel)
+        if callback is not None:
+            callback(payload)
+
+    @staticmethod
+    def _listener_lost(conn: Connection) -> None:
+        if Postgres._listener is not conn:
+            return
+
+        logger.warning("Postgres listener connection lost, reconnecting")
+        Postgres._listener = None
+        Postgres._listener_task = asyncio.create_task(
+            Postgres._reconnect_listener())
+
     @staticmethod
-    async def pool():
-        return Postgres._pool
+    async def _reconnect_listener() -> None:
+        while Postgres._channels and Postgres._listener is None:
+            try:
+                await Postgres._connect_listener()
+                logger.info("Postgres listener reconnected")
+                for reset in Postgres._resets.values():
+                    reset()
+            except (OSError, asyncio.TimeoutError,
+                    asyncpg.PostgresError) as e:
+                logger.warning(f"Failed to reconnect postgres listener: {e}")
+                await asyncio.sleep(_LISTENER_RETRY_INTERVAL)
 
     @staticmethod
     async def close():
+        Postgres._channels = {}
+        Postgres._resets = {}
+        if Postgres._listener_task is not None:
+            Postgres._listener_task.cancel()
+            Postgres._listener_task = None
+        if Postgres._listener is not None:
+            listener, Postgres._listener = Postgres._listener, None
+            await listener.close()
+
         await Postgres._pool.close()
+        Postgres._replica_url = None
+        if Postgres._replica_task is not None:
+            Postgres._replica_task.cancel()
+            Postgres._replica_task = None
+        if Postgres._replica is not None:
+            await Postgres._replica.close()
+            Postgres._replica = None
         logger.info("Postgres connection pool closed")
+
+
+def _pool_connections():
+    pools = (("primary", Postgres._pool), ("replica", Postgres._replica))
+    for name, pool in pools:
+        if pool is None:
+            continue
+        size, idle = pool.get_size(), pool.get_idle_size()
+        yield (name, "idle"), idle
+        yield (name, "in_use"), size - idle
+
+
+ACQUIRE_WAIT = Histogram("db_pool_acquire_wait_seconds",
+                         "Time spent waiting for a pool connection")
+Gauge("db_pool_connections", "Open pool connections by state",
+      ("pool", "state"), _pool_connections)
+Gauge("db_pool_waiting", "Acquires waiting for a pool connection", (),
+      lambda: [((), Postgres._waiting)])
+Counter("db_pool_acquire_timeouts_total", "Acquires that timed out", (),
+        lambda: [((), Postgres._timeouts)])
+
+
+class PrimaryAfterWriteMiddleware:
+    """Scopes read-after-write stickiness to a single request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        token = _wrote_to_primary.set(False)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _wrote_to_primary.reset(token)
@@ -1,9 +1,11 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Literal, Optional
 from uuid import UUID
 
 from pydantic import BaseModel, Field
 
+from src.dto.locations import LocationResponse
+
 
 class CreateCharacterRequest(BaseModel):
     name: str = Field(..., min_length=1, max_length=64,
@@ -20,9 +22,51 @@ class CharacterResponse(BaseModel):
 
 class CharactersResponse(BaseModel):
     characters: List[CharacterResponse]
+    next_cursor: Optional[str] = None
+
+
+Include = Literal["locations"]
+
+
+class CharacterWithLocationsResponse(CharacterResponse):
+    locations: List[LocationResponse]
+    next_cursor: Optional[str] = None
+
+
+class CharactersWithLocationsResponse(BaseModel):
+    characters: List[CharacterWithLocationsResponse]
 
 
 class UpdateCharacterRequest(BaseModel):
     name: str = Field(..., min_length=1, max_length=64,
                       description="Имя персонажа")
     description: Optional[str] = Field(None, description="Описание персонажа")
+
+
+Bucket = Literal["hour", "day", "week", "month"]
+
+
+class MovementBucketResponse(BaseModel):
+    start: datetime
+    points: int
+    distance: float
+
+
+class CharacterStatsResponse(BaseModel):
+    character_id: UUID
+    points: int
+    distance: float
+    average_speed: Optional[float]
+    max_speed: Optional[float]
+    x_min: Optional[float]
+    y_min: Optional[float]
+    x_max: Optional[float]
+    y_max: Optional[float]
+    first_at: Optional[datetime]
+    last_at: Optional[datetime]
+    buckets: List[MovementBucketResponse]
+
+
+class CharactersStatsResponse(BaseModel):
+    stats: List[CharacterStatsResponse]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,48 @@
+from datetime import timezone
+from email.utils import format_datetime
+from hashlib import blake2b
+from typing import Dict, Optional
+
+from fastapi import Request, Response, status
+
+from src.storage.base import Version
+
+
+def validators(request: Request, version: Optional[Version]) -> Dict[str, str]:
+    """ETag and Last-Modified of a collection listing.
+
+    The tag covers the query string and Accept header, so every page and
+    representation of the collection is validated separately.
+    """
+    number, updated_at = version if version is not None else (0, None)
+    variant = blake2b(
+        f"{request.url.query}|{request.headers.get('accept', '')}".encode(),
+        digest_size=8).hexdigest()
+
+    headers = {
+        "ETag": f'W/"{number}-{variant}"',
+        # Caches must revalidate, which is a cheap 304 while unchanged.
+        "Cache-Control": "no-cache",
+        "Vary": "Accept",
+    }
+    if updated_at is not None:
+        headers["Last-Modified"] = format_datetime(
+            updated_at.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+
+def not_modified(request: Request,
+                 headers: Dict[str, str]) -> Optional[Response]:
+    """Returns a 304 response if If-None-Match has the current ETag."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return None
+
+    # Weak comparison: W/ prefixes are ignored on both sides.
+    etag = headers["ETag"].removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                            headers=headers)
+    return None
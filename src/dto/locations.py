@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 from uuid import UUID
 
 from pydantic import BaseModel, Field
@@ -12,6 +12,11 @@ class CreateLocationRequest(BaseModel):
     created_at: datetime = Field(..., description="Время создания локации")
 
 
+class CreateLocationsRequest(BaseModel):
+    locations: List[CreateLocationRequest] = Field(
+        ..., min_length=1, max_length=10000, description="Локации")
+
+
 class LocationResponse(BaseModel):
     id: UUID
     character_id: UUID
@@ -22,3 +27,17 @@ class LocationResponse(BaseModel):
 
 class LocationsResponse(BaseModel):
     locations: List[LocationResponse]
+    next_cursor: Optional[str] = None
+
+
+class PositionsResponse(BaseModel):
+    positions: List[LocationResponse]
+
+
+class CreateLocationResult(BaseModel):
+    location: Optional[LocationResponse] = None
+    detail: Optional[str] = None
+
+
+class CreateLocationsResponse(BaseModel):
+    results: List[CreateLocationResult]
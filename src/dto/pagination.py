@@ -0,0 +1,21 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import Any, Callable, Tuple
+
+from src.dto.errors import InvalidCursor
+
+
+def encode_cursor(*values: Any) -> str:
+    payload = json.dumps(values, default=str).encode()
+    return urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *parsers: Callable[[Any], Any]) -> Tuple:
+    try:
+        payload = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(payload)
+        if not isinstance(values, list) or len(values) != len(parsers):
+            raise ValueError("Unexpected cursor shape")
+        return tuple(parse(value) for parse, value in zip(parsers, values))
+    except (ValueError, TypeError, AttributeError):
+        raise InvalidCursor()
@@ -0,0 +1,53 @@
+from typing import Any
+
+import msgpack
+import orjson
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+
+MSGPACK = "application/x-msgpack"
+
+
+class FastJSONResponse(JSONResponse):
+    """Serializes plain rows straight to JSON bytes.
+
+    Routes return it directly to skip response_model validation; the
+    output matches what Pydantic would produce for the same fields.
+    """
+
+    def render(self, content: Any) -> bytes:
+        # asyncpg decodes uuid columns into its own UUID subclass, which
+        # orjson only handles through the default hook.
+        return orjson.dumps(content, default=str, option=orjson.OPT_UTC_Z)
+
+
+class MsgpackResponse(Response):
+    media_type = MSGPACK
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content, default=str)
+
+
+def accepts(request: Request, media_type: str) -> bool:
+    """Whether the client prefers media_type over JSON.
+
+    Only the two types matter here, so the Accept header is compared by
+    quality without full negotiation; ties go to media_type.
+    """
+    preferred = json = 0.0
+    for item in request.headers.get("accept", "").split(","):
+        kind, *params = item.split(";")
+        kind = kind.strip().lower()
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if kind == media_type:
+            preferred = max(preferred, quality)
+        elif kind in ("application/json", "application/*", "*/*"):
+            json = max(json, quality)
+    return preferred > 0 and preferred >= json
@@ -1,23 +1,31 @@
 from contextlib import asynccontextmanager
 
-from fastapi import APIRouter, FastAPI
+from fastapi import APIRouter, FastAPI, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from uvicorn import run
 
-from src.database.postgres import Postgres
+from src.database.postgres import PrimaryAfterWriteMiddleware
+from src.monitoring.metrics import REGISTRY
+from src.monitoring.middleware import MetricsMiddleware
 from src.routes.characters import router as characters_router
 from src.routes.locations import router as locations_router
+from src.storage.backend import Storage
+from src.storage.buffer import LocationsBuffer
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
-    await Postgres.connect()
+    await Storage.connect()
+    await LocationsBuffer.start()
     yield
-    await Postgres.close()
+    await LocationsBuffer.stop()
+    await Storage.close()
 
 
 app = FastAPI(lifespan=lifespan, title="LOR API", version="1.0.0")
 
+app.add_middleware(PrimaryAfterWriteMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -25,6 +33,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 router = APIRouter(prefix="/api")
 router.include_router(characters_router)
@@ -37,5 +46,20 @@ async def ping():
     return {}
 
 
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    if not await Storage.is_ready():
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            content=Storage.stats())
+
+    return Storage.stats()
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(),
+                             media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     run(app, host="0.0.0.0", port=8000)
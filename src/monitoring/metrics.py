@@ -0,0 +1,158 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+from typing import (Awaitable, Callable, Dict, Iterable, List, Optional,
+                    Sequence, Tuple, TypeVar)
+
+T = TypeVar("T")
+
+Labels = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return (value.replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def _format_labels(names: Sequence[str], values: Iterable[str]) -> str:
+    pairs = ",".join(f'{name}="{_escape(str(value))}"'
+                     for name, value in zip(names, values))
+    return f"{{{pairs}}}" if pairs else ""
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List["Metric"] = []
+
+    def register(self, metric: "Metric") -> None:
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Metric(ABC):
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str,
+                 labels: Sequence[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        registry.register(self)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        ...
+
+
+Collector = Callable[[], Iterable[Tuple[Labels, float]]]
+
+
+class Counter(Metric):
+    """Counter that is either incremented in place or, when ``collect`` is
+    given, read from existing counters on every scrape."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str,
+                 labels: Sequence[str] = (),
+                 collect: Optional[Collector] = None,
+                 registry: Registry = REGISTRY):
+        super().__init__(name, documentation, labels, registry)
+        self._values: Dict[Labels, float] = {}
+        self._collect = collect
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        values = (self._collect() if self._collect is not None
+                  else self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, labels)} {value}"
+                for labels, value in values]
+
+
+class Gauge(Metric):
+    """Gauge whose samples are collected on every scrape."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str,
+                 labels: Sequence[str], collect: Collector,
+                 registry: Registry = REGISTRY):
+        super().__init__(name, documentation, labels, registry)
+        self._collect = collect
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, labels)} {value}"
+                for labels, value in self._collect()]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str,
+                 labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS,
+                 registry: Registry = REGISTRY):
+        super().__init__(name, documentation, labels, registry)
+        self._buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [0] * (len(self._buckets) + 2)
+        series[bisect_left(self._buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, series in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self._buckets, "+Inf"), series):
+                cumulative += count
+                names = (*self.labels, "le")
+                values = (*labels, str(bound))
+                lines.append(f"{self.name}_bucket"
+                             f"{_format_labels(names, values)} {cumulative}")
+            suffix = _format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{suffix} {series[-1]}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Duration of repository methods, including pool acquire",
+    ("repository", "method"))
+
+
+def observe_query(func: Callable[..., Awaitable[T]]
+                  ) -> Callable[..., Awaitable[T]]:
+    repository, method = func.__qualname__.rsplit(".", 1)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs) -> T:
+        started = perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            QUERY_DURATION.observe(perf_counter() - started,
+                                   repository, method)
+
+    return wrapper
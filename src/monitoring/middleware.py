@@ -0,0 +1,46 @@
+from time import perf_counter
+
+from src.monitoring.metrics import Histogram
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Duration of HTTP requests by route and status",
+    ("method", "route", "status"))
+
+
+def _route(scope) -> str:
+    """Returns the path template of the matched route, so that the label set
+    stays bounded regardless of ids in the URL."""
+    if "endpoint" not in scope:
+        return "unmatched"
+
+    params = {str(value): f"{{{name}}}"
+              for name, value in scope.get("path_params", {}).items()}
+    return "/".join(params.get(segment, segment)
+                    for segment in scope["path"].split("/"))
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_DURATION.observe(perf_counter() - started,
+                                     scope["method"], _route(scope),
+                                     str(status))
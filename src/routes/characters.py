@@ -1,31 +1,69 @@
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Union
 from uuid import UUID, uuid4
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Query, Request
 from pydantic import BaseModel
 
-from src.dto.characters import (CharacterResponse, CharactersResponse,
-                                CreateCharacterRequest, UpdateCharacterRequest)
+from src.dto.characters import (Bucket, CharacterResponse, CharactersResponse,
+                                CharactersStatsResponse,
+                                CharacterStatsResponse,
+                                CharactersWithLocationsResponse,
+                                CharacterWithLocationsResponse,
+                                CreateCharacterRequest, Include,
+                                UpdateCharacterRequest)
+from src.dto.conditional import not_modified, validators
 from src.dto.errors import CharacterNotFound, NameAlreadyExists
-from src.storage.characters import Character, CharactersRepository
+from src.dto.locations import PositionsResponse
+from src.dto.pagination import decode_cursor, encode_cursor
+from src.dto.responses import FastJSONResponse
+from src.storage.backend import Storage
+from src.storage.base import Character, DuplicateName
 
 router = APIRouter(prefix="/characters", tags=["Characters"])
 
 
+def _with_locations(character: Dict[str, Any],
+                    limit: int) -> Dict[str, Any]:
+    """Character with its first page of locations, given limit + 1 of
+    them, and the cursor of the next page in GET /locations/{id}."""
+    locations = character["locations"]
+    next_cursor = None
+    if len(locations) > limit:
+        locations = locations[:limit]
+        next_cursor = encode_cursor(locations[-1]["created_at"],
+                                    locations[-1]["id"])
+
+    return {
+        **character,
+        "locations": [dict(location) for location in locations],
+        "next_cursor": next_cursor
+    }
+
+
+def _stats(character_ids: List[UUID],
+           stats: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Stats of every character, zero for those without locations."""
+    by_id = {stat["character_id"]: stat for stat in stats}
+    return [by_id.get(character_id) or {
+        "character_id": character_id, "points": 0, "distance": 0.0,
+        "average_speed": None, "max_speed": None,
+        "x_min": None, "y_min": None, "x_max": None, "y_max": None,
+        "first_at": None, "last_at": None, "buckets": []
+    } for character_id in character_ids]
+
+
 @router.post("", response_model=CharacterResponse)
 async def create_character(request: CreateCharacterRequest):
-    character = await CharactersRepository.get_by_name(request.name)
-    if character:
-        raise NameAlreadyExists()
-
     character = Character(
         id=uuid4(),
         name=request.name,
         description=request.description,
-        created_at=datetime.now()
+        created_at=datetime.now(timezone.utc)
     )
 
-    await CharactersRepository.create(character)
+    if not await Storage.characters.create(character):
+        raise NameAlreadyExists()
 
     return CharacterResponse(
         id=character.id,
@@ -35,9 +73,114 @@ async def create_character(request: CreateCharacterRequest):
     )
 
 
-@router.get("/{character_id}", response_model=CharacterResponse)
-async def get_character(character_id: UUID):
-    character = await CharactersRepository.get_by_id(character_id)
+@router.get("/positions", response_model=PositionsResponse)
+async def get_positions():
+    locations = await Storage.locations.get_last_locations()
+
+    return FastJSONResponse({
+        "positions": [dict(location) for location in locations]
+    })
+
+
+@router.get("/search", response_model=CharactersResponse)
+async def search_characters(
+        q: str = Query(..., min_length=1, max_length=64,
+                       description="Имя или его начало, допускаются опечатки"),
+        limit: int = Query(20, ge=1, le=100,
+                           description="Количество результатов")
+):
+    characters = await Storage.characters.search(q, limit)
+
+    return FastJSONResponse({
+        "characters": [dict(character) for character in characters],
+        "next_cursor": None
+    })
+
+
+@router.get("/batch", response_model=CharactersWithLocationsResponse)
+async def get_characters_with_locations(
+        ids: List[UUID] = Query(..., min_length=1, max_length=100,
+                                description="ID персонажей"),
+        start: Optional[datetime] = Query(None, description="Начало периода"),
+        end: Optional[datetime] = Query(None, description="Конец периода"),
+        limit: int = Query(100, ge=1, le=1000,
+                           description="Размер страницы локаций "
+                                       "каждого персонажа")
+):
+    characters = await Storage.characters.get_with_locations(
+        list(dict.fromkeys(ids)), start, end, limit + 1)
+
+    return FastJSONResponse({
+        "characters": [_with_locations(character, limit)
+                       for character in characters]
+    })
+
+
+@router.get("/stats", response_model=CharactersStatsResponse)
+async def get_characters_stats(
+        start: Optional[datetime] = Query(None, description="Начало периода"),
+        end: Optional[datetime] = Query(None, description="Конец периода"),
+        bucket: Bucket = Query("day", description="Интервал подсчета точек"),
+        limit: int = Query(100, ge=1, le=1000,
+                           description="Размер страницы"),
+        cursor: Optional[str] = Query(None,
+                                      description="Курсор страницы")
+):
+    after = decode_cursor(cursor, UUID)[0] if cursor else None
+    character_ids = await Storage.characters.list_ids(limit + 1, after)
+
+    next_cursor = None
+    if len(character_ids) > limit:
+        character_ids = character_ids[:limit]
+        next_cursor = encode_cursor(character_ids[-1])
+
+    stats = await Storage.locations.get_stats(
+        character_ids, bucket, start, end)
+
+    return FastJSONResponse({
+        "stats": _stats(character_ids, stats),
+        "next_cursor": next_cursor
+    })
+
+
+@router.get("/{character_id}/stats", response_model=CharacterStatsResponse)
+async def get_character_stats(
+        character_id: UUID,
+        start: Optional[datetime] = Query(None, description="Начало периода"),
+        end: Optional[datetime] = Query(None, description="Конец периода"),
+        bucket: Bucket = Query("day", description="Интервал подсчета точек")
+):
+    character = await Storage.characters.get_by_id(character_id)
+    if not character:
+        raise CharacterNotFound()
+
+    stats = await Storage.locations.get_stats(
+        [character_id], bucket, start, end)
+
+    return FastJSONResponse(_stats([character_id], stats)[0])
+
+
+@router.get("/{character_id}",
+            response_model=Union[CharacterWithLocationsResponse,
+                                 CharacterResponse])
+async def get_character(
+        character_id: UUID,
+        include: Optional[Include] = Query(
+            None, description="Вложить локации персонажа"),
+        start: Optional[datetime] = Query(None, description="Начало периода"),
+        end: Optional[datetime] = Query(None, description="Конец периода"),
+        limit: int = Query(100, ge=1, le=1000,
+                           description="Размер страницы локаций")
+):
+    if include == "locations":
+        characters = await Storage.characters.get_with_locations(
+            [character_id], start, end, limit + 1)
+        if not characters:
+            raise CharacterNotFound()
+
+        return FastJSONResponse(_with_locations(characters[0], limit))
+
+    character = await Storage.characters.get_by_id(character_id)
     if not character:
         raise CharacterNotFound()
 
@@ -50,32 +193,46 @@ async def get_character(character_id: UUID):
 
 
 @router.get("", response_model=CharactersResponse)
-async def get_characters():
-    characters = await CharactersRepository.list()
-
-    return CharactersResponse(
-        characters=[
-            CharacterResponse(
-                id=character.id,
-                name=character.name,
-                description=character.description,
-                created_at=character.created_at
-            ) for character in characters
-        ]
-    )
+async def get_characters(
+        request: Request,
+        limit: int = Query(100, ge=1, le=1000,
+                           description="Размер страницы"),
+        cursor: Optional[str] = Query(None,
+                                      description="Курсор страницы")
+):
+    after = decode_cursor(cursor, str, UUID) if cursor else None
+
+    headers = validators(request, await Storage.characters.get_version())
+    response = not_modified(request, headers)
+    if response is not None:
+        return response
+
+    characters = await Storage.characters.list(limit + 1, after)
+
+    next_cursor = None
+    if len(characters) > limit:
+        characters = characters[:limit]
+        next_cursor = encode_cursor(characters[-1]["name"],
+                                    characters[-1]["id"])
+
+    return FastJSONResponse({
+        "characters": [dict(character) for character in characters],
+        "next_cursor": next_cursor
+    }, headers=headers)
 
 
 @router.put("/{character_id}", response_model=CharacterResponse)
 async def update_character(character_id: UUID,
                            request: UpdateCharacterRequest):
-    character = await CharactersRepository.get_by_id(character_id)
+    try:
+        character = await Storage.characters.update(
+            character_id, request.name, request.description)
+    except DuplicateName:
+        raise NameAlreadyExists()
+
     if not character:
         raise CharacterNotFound()
 
-    character.name = request.name
-    character.description = request.description
-    await CharactersRepository.update(character)
-
     return CharacterResponse(
         id=character.id,
         name=character.name,
@@ -86,10 +243,7 @@ async def update_character(character_id: UUID,
 
 @router.delete("/{character_id}", response_model=BaseModel)
 async def delete_character(character_id: UUID):
-    character = await CharactersRepository.get_by_id(character_id)
-    if not character:
+    if not await Storage.characters.delete(character_id):
         raise CharacterNotFound()
 
-    await CharactersRepository.delete(character.id)
-
     return {}
@@ -1,22 +1,46 @@
-from datetime import datetime
-from typing import Optional
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
 from uuid import UUID, uuid4
 
-from fastapi import APIRouter, Query
+import numpy as np
+import orjson
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+from src.analytics.trajectory import simplify
+from src.dto.conditional import not_modified, validators
 from src.dto.errors import CharacterNotFound, LocationNotFound
-from src.dto.locations import (CreateLocationRequest, LocationResponse,
-                               LocationsResponse)
-from src.storage.characters import CharactersRepository
-from src.storage.locations import Location, LocationsRepository
+from src.dto.locations import (CreateLocationRequest, CreateLocationResult,
+                               CreateLocationsRequest, CreateLocationsResponse,
+                               LocationResponse, LocationsResponse)
+from src.dto.pagination import decode_cursor, encode_cursor
+from src.dto.responses import (MSGPACK, FastJSONResponse, MsgpackResponse,
+                               accepts)
+from src.storage.backend import Storage
+from src.storage.base import Location, MissingCharacter, Row
+from src.storage.buffer import LocationsBuffer
+from src.storage.events import LocationEvents
 
 router = APIRouter(prefix="/locations", tags=["Locations"])
 
+EXPORT_CHUNK_SIZE = 1000
+LIVE_HEARTBEAT_INTERVAL = 15.0
+
+# Size of a simplified track when only tolerance bounds it.
+SIMPLIFY_MAX_POINTS = 10000
+# Douglas–Peucker picks max_points out of at most this many times more
+# locations; longer periods are pre-reduced by time buckets in storage.
+SIMPLIFY_OVERSAMPLING = 10
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
 
 @router.post("", response_model=LocationResponse)
 async def create_location(request: CreateLocationRequest):
-    character = await CharactersRepository.get_by_id(request.character_id)
+    character = await Storage.characters.get_by_id(request.character_id)
     if not character:
         raise CharacterNotFound()
 
@@ -28,7 +52,11 @@ async def create_location(request: CreateLocationRequest):
         created_at=request.created_at
     )
 
-    await LocationsRepository.create(location)
+    try:
+        await LocationsBuffer.add(location)
+    except MissingCharacter:
+        # Deleted after the check above, possibly by another worker.
+        raise CharacterNotFound()
 
     return LocationResponse(
         id=location.id,
@@ -39,43 +67,275 @@ async def create_location(request: CreateLocationRequest):
     )
 
 
-@router.get("/{character_id}", response_model=LocationsResponse)
+@router.post("/batch", response_model=CreateLocationsResponse)
+async def create_locations(request: CreateLocationsRequest):
+    locations = [
+        Location(
+            id=uuid4(),
+            character_id=item.character_id,
+            x=item.x,
+            y=item.y,
+            created_at=item.created_at
+        )
+        for item in request.locations
+    ]
+    existing_ids = await Storage.characters.get_existing_ids(
+        {location.character_id for location in locations})
+
+    while True:
+        stored = [location for location in locations
+                  if location.character_id in existing_ids]
+        if not stored:
+            break
+
+        try:
+            await Storage.locations.create_many(stored)
+            break
+        except MissingCharacter:
+            # Deleted after the check above, possibly by another worker:
+            # nothing was stored, so retry without its locations.
+            existing_ids = await Storage.characters.get_existing_ids(
+                existing_ids)
+
+    results = []
+    for location in locations:
+        if location.character_id not in existing_ids:
+            results.append(CreateLocationResult(
+                detail=CharacterNotFound().detail))
+            continue
+
+        results.append(CreateLocationResult(
+            location=LocationResponse(
+                id=location.id,
+                character_id=location.character_id,
+                x=location.x,
+                y=location.y,
+                created_at=location.created_at
+            )
+        ))
+
+    return CreateLocationsResponse(results=results)
+
+
+@router.get("/within", response_model=LocationsResponse)
+async def get_locations_within(
+        x_min: float = Query(..., description="Минимальная координата X"),
+        y_min: float = Query(..., description="Минимальная координата Y"),
+        x_max: float = Query(..., description="Максимальная координата X"),
+        y_max: float = Query(..., description="Максимальная координата Y"),
+        start: Optional[datetime] = Query(None, description="Начало периода"),
+        end: Optional[datetime] = Query(None, description="Конец периода"),
+        limit: int = Query(100, ge=1, le=1000,
+                           description="Размер страницы"),
+        cursor: Optional[str] = Query(None,
+                                      description="Курсор страницы")
+):
+    after = (decode_cursor(cursor, datetime.fromisoformat, UUID)
+             if cursor else None)
+
+    locations = await Storage.locations.get_within(
+        x_min, y_min, x_max, y_max, start, end, limit + 1, after)
+
+    next_cursor = None
+    if len(locations) > limit:
+        locations = locations[:limit]
+        next_cursor = encode_cursor(locations[-1]["created_at"],
+                                    locations[-1]["id"])
+
+    return FastJSONResponse({
+        "locations": [dict(location) for location in locations],
+        "next_cursor": next_cursor
+    })
+
+
+@router.get("/nearest", response_model=LocationsResponse)
+async def get_nearest_locations(
+        x: float = Query(..., description="Координата X"),
+        y: float = Query(..., description="Координата Y"),
+        k: int = Query(10, ge=1, le=1000, description="Количество локаций"),
+        start: Optional[datetime] = Query(None, description="Начало периода"),
+        end: Optional[datetime] = Query(None, description="Конец периода")
+):
+    locations = await Storage.locations.get_nearest(x, y, k, start, end)
+
+    return FastJSONResponse({
+        "locations": [dict(location) for location in locations],
+        "next_cursor": None
+    })
+
+
+async def _live_events(character_id: Optional[UUID]) -> AsyncIterator[bytes]:
+    subscription = LocationEvents.subscribe(character_id)
+    queue = subscription.queue
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(),
+                                                 LIVE_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                # Keeps proxies from timing the stream out.
+                yield b": ping\n\n"
+                continue
+
+            # Sends everything already queued in one write.
+            messages = [message]
+            while message is not None and not queue.empty():
+                message = queue.get_nowait()
+                messages.append(message)
+            if message is None:
+                yield b"".join(messages[:-1])
+                return
+            yield b"".join(messages)
+    finally:
+        LocationEvents.unsubscribe(subscription)
+
+
+def _live_response(character_id: Optional[UUID]) -> StreamingResponse:
+    return StreamingResponse(
+        _live_events(character_id), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/stream", response_class=StreamingResponse)
+async def stream_locations():
+    return _live_response(None)
+
+
+def _columnar(character_id: UUID, rows: Sequence[Row],
+              next_cursor: Optional[str]) -> Dict[str, Any]:
+    """Track as packed little-endian columns: x and y as float64,
+    created_at as int64 microseconds since the epoch."""
+    x = np.fromiter((row["x"] for row in rows), "<f8", len(rows))
+    y = np.fromiter((row["y"] for row in rows), "<f8", len(rows))
+    created_at = np.fromiter(
+        ((row["created_at"] - _EPOCH) // _MICROSECOND for row in rows),
+        "<i8", len(rows))
+
+    return {
+        "character_id": str(character_id),
+        "count": len(rows),
+        "x": x.tobytes(),
+        "y": y.tobytes(),
+        "created_at": created_at.tobytes(),
+        "next_cursor": next_cursor
+    }
+
+
+def _locations_response(request: Request, character_id: UUID,
+                        rows: List[Row], next_cursor: Optional[str],
+                        headers: Dict[str, str]):
+    if accepts(request, MSGPACK):
+        return MsgpackResponse(
+            _columnar(character_id, rows, next_cursor), headers=headers)
+
+    return FastJSONResponse({
+        "locations": [dict(row) for row in rows],
+        "next_cursor": next_cursor
+    }, headers=headers)
+
+
+@router.get("/{character_id}", response_model=LocationsResponse,
+            responses={200: {"content": {MSGPACK: {}}}})
 async def get_locations(
+        request: Request,
+        character_id: UUID,
+        start: Optional[datetime] = Query(None, description="Начало периода"),
+        end: Optional[datetime] = Query(None, description="Конец периода"),
+        limit: int = Query(100, ge=1, le=1000,
+                           description="Размер страницы"),
+        cursor: Optional[str] = Query(None,
+                                      description="Курсор страницы"),
+        max_points: Optional[int] = Query(
+            None, ge=2, le=SIMPLIFY_MAX_POINTS,
+            description="Максимум точек упрощенного трека "
+                        "(без пагинации, с tolerance по умолчанию "
+                        f"{SIMPLIFY_MAX_POINTS})"),
+        tolerance: Optional[float] = Query(
+            None, gt=0,
+            description="Допустимое отклонение упрощенного трека "
+                        "(без пагинации)")
+):
+    after = (decode_cursor(cursor, datetime.fromisoformat, UUID)
+             if cursor else None)
+
+    character = await Storage.characters.get_by_id(character_id)
+    if not character:
+        raise CharacterNotFound()
+
+    headers = validators(
+        request, await Storage.locations.get_version(character_id))
+    response = not_modified(request, headers)
+    if response is not None:
+        return response
+
+    if max_points is not None or tolerance is not None:
+        max_points = max_points or SIMPLIFY_MAX_POINTS
+        rows = await Storage.locations.get_track(
+            character_id, start, end, max_points * SIMPLIFY_OVERSAMPLING)
+        x = np.fromiter((row["x"] for row in rows), float, len(rows))
+        y = np.fromiter((row["y"] for row in rows), float, len(rows))
+
+        return _locations_response(
+            request, character_id,
+            [rows[index] for index in simplify(x, y, max_points, tolerance)],
+            None, headers)
+
+    locations = await Storage.locations.get_by_character_id(
+        character_id, start, end, limit + 1, after)
+
+    next_cursor = None
+    if len(locations) > limit:
+        locations = locations[:limit]
+        next_cursor = encode_cursor(locations[-1]["created_at"],
+                                    locations[-1]["id"])
+
+    return _locations_response(request, character_id, locations,
+                               next_cursor, headers)
+
+
+@router.get("/{character_id}/export", response_class=StreamingResponse)
+async def export_locations(
         character_id: UUID,
         start: Optional[datetime] = Query(None, description="Начало периода"),
         end: Optional[datetime] = Query(None, description="Конец периода")
 ):
-    character = await CharactersRepository.get_by_id(character_id)
+    character = await Storage.characters.get_by_id(character_id)
     if not character:
         raise CharacterNotFound()
 
-    locations = await LocationsRepository.get_by_character_id(character_id)
+    async def lines() -> AsyncIterator[bytes]:
+        chunk = []
+        async for row in Storage.locations.iterate_by_character_id(
+                character_id, start, end, prefetch=EXPORT_CHUNK_SIZE):
+            # Same encoding as the JSON responses: UTC as "Z".
+            chunk.append(orjson.dumps({
+                "id": row["id"],
+                "character_id": row["character_id"],
+                "x": row["x"],
+                "y": row["y"],
+                "created_at": row["created_at"]
+            }, default=str, option=orjson.OPT_UTC_Z) + b"\n")
+            if len(chunk) >= EXPORT_CHUNK_SIZE:
+                yield b"".join(chunk)
+                chunk.clear()
+        if chunk:
+            yield b"".join(chunk)
 
-    filtered_locations = [
-        loc for loc in locations
-        if (start is None or loc.created_at >= start) and
-           (end is None or loc.created_at <= end)
-    ]
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
-    return LocationsResponse(
-        locations=[
-            LocationResponse(
-                id=location.id,
-                character_id=location.character_id,
-                x=location.x,
-                y=location.y,
-                created_at=location.created_at
-            ) for location in filtered_locations
-        ]
-    )
+
+@router.get("/{character_id}/stream", response_class=StreamingResponse)
+async def stream_character_locations(character_id: UUID):
+    character = await Storage.characters.get_by_id(character_id)
+    if not character:
+        raise CharacterNotFound()
+
+    return _live_response(character_id)
 
 
 @router.delete("/{location_id}", response_model=BaseModel)
 async def delete_location(location_id: UUID):
-    location = await LocationsRepository.get_by_id(location_id)
-    if not location:
+    if not await Storage.locations.delete(location_id):
         raise LocationNotFound()
 
-    await LocationsRepository.delete(location.id)
-
     return {}
@@ -0,0 +1,79 @@
+"""Production entry point: ``python -m src.server``.
+
+Pre-forks SERVER_WORKERS uvicorn workers (one per available core by
+default) sharing one listening socket. uvloop and httptools are picked up
+automatically when the ``speedups`` extra is installed.
+
+POSTGRES_POOL_BUDGET (80 by default, under Postgres' default
+max_connections of 100) caps the connections of the whole node and is
+split evenly between the workers, counting the LISTEN connection each of
+them holds. On SIGTERM/SIGINT every worker stops accepting connections,
+waits up to SERVER_GRACEFUL_TIMEOUT seconds for in-flight requests and
+closes its pool from the application lifespan.
+"""
+import logging
+import os
+from typing import Dict
+
+from uvicorn import run
+
+from src.config import env
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_BUDGET = 80
+
+# Every worker listens for notifications on a connection of its own.
+LISTENER_CONNECTIONS = 1
+
+
+def available_cores() -> int:
+    # Respects CPU affinity, e.g. docker --cpuset-cpus.
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def pool_settings(workers: int, budget: int, min_size: int,
+                  max_size: int) -> Dict[str, str]:
+    """Per-worker pool sizes that keep the node within the budget."""
+    per_worker = budget // workers - LISTENER_CONNECTIONS
+    if per_worker < 1:
+        logger.warning(f"POSTGRES_POOL_BUDGET={budget} is too small for "
+                       f"{workers} workers, using one pool connection each")
+    max_size = max(1, min(max_size, per_worker))
+    return {
+        "POSTGRES_POOL_MAX_SIZE": str(max_size),
+        "POSTGRES_POOL_MIN_SIZE": str(min(min_size, max_size)),
+    }
+
+
+def main() -> None:
+    workers = env("SERVER_WORKERS", available_cores(), int)
+    if os.getenv("STORAGE_BACKEND") == "memory" and workers > 1:
+        # Every worker would hold its own copy of the data.
+        logger.warning("In-memory storage is per process, "
+                       "running a single worker")
+        workers = 1
+
+    # Workers are spawned with a copy of this environment.
+    os.environ.update(pool_settings(
+        workers, env("POSTGRES_POOL_BUDGET", DEFAULT_POOL_BUDGET, int),
+        env("POSTGRES_POOL_MIN_SIZE", 1, int),
+        env("POSTGRES_POOL_MAX_SIZE", 10, int)))
+
+    run("src.main:app",
+        host=env("SERVER_HOST", "0.0.0.0", str),
+        port=env("SERVER_PORT", 8000, int),
+        workers=workers,
+        loop="auto",
+        http="auto",
+        backlog=env("SERVER_BACKLOG", 2048, int),
+        timeout_keep_alive=env("SERVER_KEEP_ALIVE", 5, int),
+        timeout_graceful_shutdown=env("SERVER_GRACEFUL_TIMEOUT", 30, int),
+        access_log=env("SERVER_ACCESS_LOG", False,
+                       lambda value: value.lower() in ("1", "true")))
+
+
+if __name__ == "__main__":
+    main()
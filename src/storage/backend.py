@@ -0,0 +1,67 @@
+import logging
+import os
+from typing import Any, Dict, Type
+
+from src.database.postgres import Postgres
+from src.storage.base import CharactersRepository, LocationsRepository
+from src.storage.characters import PostgresCharactersRepository
+from src.storage.events import LocationEvents
+from src.storage.locations import PostgresLocationsRepository
+from src.storage.memory import (Memory, MemoryCharactersRepository,
+                                MemoryLocationsRepository)
+from src.storage.partitions import LocationsPartitions
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = {
+    "postgres": (PostgresCharactersRepository, PostgresLocationsRepository),
+    "memory": (MemoryCharactersRepository, MemoryLocationsRepository),
+}
+
+
+class Storage:
+    """Repositories of the backend selected by STORAGE_BACKEND at startup."""
+
+    backend = "postgres"
+    characters: Type[CharactersRepository] = PostgresCharactersRepository
+    locations: Type[LocationsRepository] = PostgresLocationsRepository
+
+    @staticmethod
+    async def connect() -> None:
+        backend = os.getenv("STORAGE_BACKEND", "postgres")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+        if backend == "postgres":
+            await Postgres.connect()
+            await Postgres.listen("locations",
+                                  LocationEvents.publish_notification)
+            # Keeps the caches of all server workers coherent.
+            await Postgres.listen("characters",
+                                  PostgresCharactersRepository.invalidate,
+                                  PostgresCharactersRepository.clear_cache)
+            LocationsPartitions.start()
+        else:
+            Memory.reset()
+
+        Storage.backend = backend
+        Storage.characters, Storage.locations = BACKENDS[backend]
+        logger.info(f"Using {backend} storage backend")
+
+    @staticmethod
+    async def close() -> None:
+        if Storage.backend == "postgres":
+            await LocationsPartitions.stop()
+            await Postgres.close()
+
+    @staticmethod
+    async def is_ready() -> bool:
+        if Storage.backend == "postgres":
+            return await Postgres.is_ready()
+        return True
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        if Storage.backend == "postgres":
+            return Postgres.stats()
+        return Memory.stats()
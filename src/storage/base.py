@@ -0,0 +1,233 @@
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import (Any, AsyncIterator, Dict, Iterable, List, Mapping,
+                    Optional, Set, Tuple)
+from uuid import UUID
+
+from pydantic import BaseModel
+
+# Rows returned by listing methods: asyncpg records or read-only mappings
+# with the same keys, ready to be passed to dict().
+Row = Mapping[str, Any]
+
+# A collection's version number and the time of its last change.
+Version = Tuple[int, datetime]
+
+# Share of the query's trigrams a name needs to match it with typos.
+SEARCH_THRESHOLD = float(os.getenv("CHARACTERS_SEARCH_THRESHOLD", "0.4"))
+
+# Fuzzy matching needs a whole trigram to be selective.
+SEARCH_FUZZY_MIN_LENGTH = 3
+
+
+class Character(BaseModel):
+    id: UUID
+    name: str
+    description: Optional[str]
+    created_at: datetime
+
+
+class Location(BaseModel):
+    id: UUID
+    character_id: UUID
+    x: float
+    y: float
+    created_at: datetime
+
+
+class DuplicateName(Exception):
+    pass
+
+
+class MissingCharacter(Exception):
+    pass
+
+
+class CharactersRepository(ABC):
+    @staticmethod
+    @abstractmethod
+    async def create(character: Character) -> bool:
+        """Returns False if the name is already taken.
+
+        On success sets created_at to the value as stored.
+        """
+
+    @staticmethod
+    @abstractmethod
+    async def get_by_id(id: UUID) -> Optional[Character]:
+        ...
+
+    @staticmethod
+    @abstractmethod
+    async def get_existing_ids(ids: Iterable[UUID]) -> Set[UUID]:
+        ...
+
+    @staticmethod
+    @abstractmethod
+    async def list(
+            limit: Optional[int] = None,
+            after: Optional[Tuple[str, UUID]] = None
+    ) -> List[Row]:
+        """Characters ordered by (name, id), after the given key."""
+
+    @staticmethod
+    @abstractmethod
+    async def list_ids(limit: int, after: Optional[UUID] = None) -> List[UUID]:
+        """Character ids in ascending order, after the given id."""
+
+    @staticmethod
+    @abstractmethod
+    async def get_with_locations(
+            ids: List[UUID],
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Characters in the order of ids, missing ones skipped, each with
+        locations: the first limit of its locations in the period, ordered
+        by (created_at, id)."""
+
+    @staticmethod
+    @abstractmethod
+    async def search(query: str, limit: int) -> List[Row]:
+        """Characters whose name starts with the query, ignoring case,
+        ordered by name. Queries of SEARCH_FUZZY_MIN_LENGTH characters or
+        more also match names sharing SEARCH_THRESHOLD of their trigrams,
+        most similar first, after the prefix matches."""
+
+    @staticmethod
+    @abstractmethod
+    async def update(id: UUID, name: str,
+                     description: Optional[str]) -> Optional[Character]:
+        """Raises DuplicateName if the name is taken by another character."""
+
+    @staticmethod
+    @abstractmethod
+    async def delete(id: UUID) -> bool:
+        """Deletes the character together with its locations."""
+
+    @staticmethod
+    @abstractmethod
+    async def get_version() -> Optional[Version]:
+        """Changes on every write to characters, None before the first."""
+
+
+class LocationsRepository(ABC):
+    @staticmethod
+    @abstractmethod
+    async def create(location: Location) -> None:
+        """Raises MissingCharacter if the character does not exist."""
+
+    @staticmethod
+    @abstractmethod
+    async def create_many(locations: List[Location]) -> None:
+        """Stores every location or none; raises MissingCharacter if a
+        character does not exist."""
+
+    @staticmethod
+    @abstractmethod
+    async def get_by_id(id: UUID) -> Optional[Location]:
+        ...
+
+    @staticmethod
+    @abstractmethod
+    async def get_by_character_id(
+            character_id: UUID,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            limit: Optional[int] = None,
+            after: Optional[Tuple[datetime, UUID]] = None
+    ) -> List[Row]:
+        """Locations ordered by (created_at, id), after the given key."""
+
+    @staticmethod
+    @abstractmethod
+    async def get_track(
+            character_id: UUID,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            max_rows: Optional[int] = None
+    ) -> List[Row]:
+        """Locations ordered by (created_at, id). Past max_rows the period
+        is split into max_rows equal time buckets, each giving the location
+        nearest to the mean position of its bucket, and the first and last
+        locations are kept."""
+
+    @staticmethod
+    @abstractmethod
+    def iterate_by_character_id(
+            character_id: UUID,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            prefetch: int = 1000
+    ) -> AsyncIterator[Row]:
+        ...
+
+    @staticmethod
+    @abstractmethod
+    async def get_within(
+            x_min: float,
+            y_min: float,
+            x_max: float,
+            y_max: float,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            limit: Optional[int] = None,
+            after: Optional[Tuple[datetime, UUID]] = None
+    ) -> List[Row]:
+        """Locations inside the box, borders included, ordered by
+        (created_at, id), after the given key."""
+
+    @staticmethod
+    @abstractmethod
+    async def get_nearest(
+            x: float,
+            y: float,
+            limit: int,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None
+    ) -> List[Row]:
+        ...
+
+    @staticmethod
+    @abstractmethod
+    async def get_stats(
+            character_ids: List[UUID],
+            bucket: str,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None
+    ) -> List[Dict[str, Any]]:
+        """Movement stats of those of the characters with locations in the
+        period, by character id.
+
+        Each has points, distance, average_speed and max_speed (units per
+        second, None without movement), the bounding box, first_at,
+        last_at and buckets: points and distance per bucket ("hour",
+        "day", "week" or "month", UTC), a step counting towards the bucket
+        of the point it ends at."""
+
+    @staticmethod
+    @abstractmethod
+    async def get_last_locations() -> List[Row]:
+        """The latest location of every character, by character id."""
+
+    @staticmethod
+    @abstractmethod
+    async def list() -> List[Location]:
+        ...
+
+    @staticmethod
+    @abstractmethod
+    async def update(location: Location) -> None:
+        ...
+
+    @staticmethod
+    @abstractmethod
+    async def delete(id: UUID) -> bool:
+        ...
+
+    @staticmethod
+    @abstractmethod
+    async def get_version(character_id: UUID) -> Optional[Version]:
+        """Changes on every write to the character's locations."""
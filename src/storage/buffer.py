@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import os
+from contextlib import suppress
+from typing import List, Optional, Tuple
+
+from src.monitoring.metrics import Counter, Gauge
+from src.storage.backend import Storage
+from src.storage.base import Location, MissingCharacter
+
+logger = logging.getLogger(__name__)
+
+# off: every location is inserted on its own.
+# flush: requests are acknowledged once their batch is written.
+# enqueue: requests are acknowledged once queued; a crash loses the queue.
+MODES = ("off", "flush", "enqueue")
+
+Pending = Tuple[Location, Optional[asyncio.Future]]
+
+FLUSHED = Counter("locations_buffer_flushed_total",
+                  "Locations written by the write-behind buffer")
+FAILED = Counter("locations_buffer_failed_total",
+                 "Buffered locations that could not be written")
+
+
+class LocationsBuffer:
+    """Coalesces single location inserts into COPY batches.
+
+    A batch is written when LOCATIONS_BUFFER_ROWS locations are queued or
+    LOCATIONS_BUFFER_INTERVAL_MS after the first one, whichever is first.
+    Writers wait while LOCATIONS_BUFFER_SIZE locations are pending.
+    """
+
+    _mode = "off"
+    _rows = 1000
+    _interval = 0.01
+    _max_pending = 10000
+    _pending: List[Pending] = []
+    _ready: Optional[asyncio.Event] = None
+    _full: Optional[asyncio.Event] = None
+    _not_full: Optional[asyncio.Event] = None
+    _closing = False
+    _task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    async def start() -> None:
+        mode = os.getenv("LOCATIONS_BUFFER", "off")
+        if mode not in MODES:
+            raise ValueError(f"Unknown LOCATIONS_BUFFER: {mode}")
+
+        LocationsBuffer._mode = mode
+        if mode == "off":
+            return
+
+        LocationsBuffer._rows = int(os.getenv("LOCATIONS_BUFFER_ROWS",
+                                              "1000"))
+        LocationsBuffer._interval = float(os.getenv(
+            "LOCATIONS_BUFFER_INTERVAL_MS", "10")) / 1000
+        LocationsBuffer._max_pending = max(
+            LocationsBuffer._rows,
+            int(os.getenv("LOCATIONS_BUFFER_SIZE", "10000")))
+        LocationsBuffer._pending = []
+        LocationsBuffer._ready = asyncio.Event()
+        LocationsBuffer._full = asyncio.Event()
+        LocationsBuffer._not_full = asyncio.Event()
+        LocationsBuffer._closing = False
+        LocationsBuffer._task = asyncio.create_task(LocationsBuffer._run())
+        logger.info(f"Locations write-behind buffer started in {mode} mode")
+
+    @staticmethod
+    async def stop() -> None:
+        """Writes everything still pending and stops the flusher."""
+        task = LocationsBuffer._task
+        if task is None:
+            return
+
+        LocationsBuffer._closing = True
+        LocationsBuffer._ready.set()
+        LocationsBuffer._full.set()
+        await task
+        LocationsBuffer._task = None
+
+    @staticmethod
+    async def add(location: Location) -> None:
+        if LocationsBuffer._task is None:
+            await Storage.locations.create(location)
+            return
+
+        while len(LocationsBuffer._pending) >= LocationsBuffer._max_pending:
+            LocationsBuffer._not_full.clear()
+            await LocationsBuffer._not_full.wait()
+        pending = LocationsBuffer._pending
+
+        future = None
+        if LocationsBuffer._mode == "flush":
+            future = asyncio.get_running_loop().create_future()
+        pending.append((location, future))
+        LocationsBuffer._ready.set()
+        if len(pending) >= LocationsBuffer._rows:
+            LocationsBuffer._full.set()
+
+        if future is not None:
+            await future
+
+    @staticmethod
+    def pending() -> int:
+        return len(LocationsBuffer._pending)
+
+    @staticmethod
+    async def _run() -> None:
+        while True:
+            await LocationsBuffer._ready.wait()
+            if (not LocationsBuffer._closing
+                    and len(LocationsBuffer._pending) < LocationsBuffer._rows):
+                # Gives concurrent writers the interval to join the batch.
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(LocationsBuffer._full.wait(),
+                                           LocationsBuffer._interval)
+
+            pending = LocationsBuffer._pending
+            if not pending:
+                if LocationsBuffer._closing:
+                    return
+                LocationsBuffer._ready.clear()
+                continue
+
+            batch = pending[:LocationsBuffer._rows]
+            del pending[:LocationsBuffer._rows]
+            if len(pending) < LocationsBuffer._rows \
+                    and not LocationsBuffer._closing:
+                LocationsBuffer._full.clear()
+            LocationsBuffer._not_full.set()
+            await LocationsBuffer._write(batch)
+
+    @staticmethod
+    async def _write(batch: List[Pending]) -> None:
+        try:
+            await LocationsBuffer._copy(batch)
+        except MissingCharacter as e:
+            if len(batch) == 1:
+                LocationsBuffer._fail(batch, e)
+                return
+
+            # A location whose character was deleted meanwhile fails the
+            # whole COPY, so the rows are retried one by one.
+            logger.warning(f"Failed to write {len(batch)} buffered "
+                           f"locations, retrying one by one: {e}")
+            for index, item in enumerate(batch):
+                try:
+                    await LocationsBuffer._copy([item])
+                except MissingCharacter as e:
+                    LocationsBuffer._fail([item], e)
+                except Exception as e:
+                    LocationsBuffer._fail(batch[index:], e)
+                    return
+        except Exception as e:
+            # Connection losses and pool timeouts would fail every row the
+            # same way, one acquire timeout each.
+            LocationsBuffer._fail(batch, e)
+
+    @staticmethod
+    async def _copy(batch: List[Pending]) -> None:
+        await Storage.locations.create_many(
+            [location for location, _ in batch])
+
+        FLUSHED.inc(amount=len(batch))
+        for _, future in batch:
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    @staticmethod
+    def _fail(batch: List[Pending], error: Exception) -> None:
+        FAILED.inc(amount=len(batch))
+        dropped = 0
+        for _, future in batch:
+            if future is None:
+                dropped += 1
+            elif not future.done():
+                future.set_exception(error)
+        if dropped:
+            logger.error(f"Dropped {dropped} buffered locations: "
+                         f"{error!r}")
+
+
+Gauge("locations_buffer_pending", "Locations waiting in the buffer", (),
+      lambda: [((), LocationsBuffer.pending())])
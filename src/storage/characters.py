@@ -1,76 +1,273 @@
+import os
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 from uuid import UUID
 
-from pydantic import BaseModel
+from asyncpg import Record, UniqueViolationError
 
-from src.database.postgres import Postgres
+from src.database.postgres import Postgres, retry_on_primary
+from src.monitoring.metrics import Counter, Gauge, observe_query
+from src.storage.base import (SEARCH_FUZZY_MIN_LENGTH, SEARCH_THRESHOLD,
+                              Character, CharactersRepository, DuplicateName,
+                              Version)
+from src.storage.cache import LRUCache
+from src.storage.locations import _period_conditions
 
+_characters = LRUCache(int(os.getenv("CHARACTERS_CACHE_SIZE", "10000")),
+                       float(os.getenv("CHARACTERS_CACHE_TTL", "30")))
 
-class Character(BaseModel):
-    id: UUID
-    name: str
-    description: Optional[str]
-    created_at: datetime
+_caches = {"characters": _characters}
 
+Gauge("cache_entries", "Number of entries in in-process caches", ("cache",),
+      lambda: [((name,), cache.stats()["size"])
+               for name, cache in _caches.items()])
+Counter("cache_hits_total", "In-process cache hits", ("cache",),
+        lambda: [((name,), cache.hits) for name, cache in _caches.items()])
+Counter("cache_misses_total", "In-process cache misses", ("cache",),
+        lambda: [((name,), cache.misses)
+                 for name, cache in _caches.items()])
 
-class CharactersRepository:
-    @staticmethod
-    async def create(character: Character) -> None:
-        pool = await Postgres.pool()
 
-        async with pool.acquire() as conn:
+# Greater than any character, so that name_folded ~<~ (prefix || _PREFIX_END)
+# bounds the range of names starting with prefix.
+_PREFIX_END = "\U0010ffff"
+
+# name_folded is generated by fold_name(), which unlike plain lower() folds
+# Cyrillic under C ctype too; $1 is the query, folded the same way.
+_PREFIX_CONDITION = ("name_folded ~>=~ fold_name($1) "
+                     "AND name_folded ~<~ (fold_name($1) || $2)")
+
+_LOCATION_KEYS = ("id", "character_id", "x", "y", "created_at")
+
+
+def _remember(character: Character) -> Character:
+    _characters.set(character.id, character.model_copy())
+    return character
+
+
+class PostgresCharactersRepository(CharactersRepository):
+    # Whether migration 012 could create the trigram index.
+    _trigrams: Optional[bool] = None
+
+    @staticmethod
+    @observe_query
+    async def create(character: Character) -> bool:
+        async with Postgres.acquire() as conn:
             query = ("INSERT INTO characters (id, name, description, "
-                     "created_at) VALUES ($1, $2, $3, $4)")
-            await conn.execute(
+                     "created_at) VALUES ($1, $2, $3, $4) "
+                     "ON CONFLICT (name) DO NOTHING RETURNING created_at")
+            created_at = await conn.fetchval(
                 query, character.id, character.name,
                 character.description, character.created_at)
 
+        if created_at is None:
+            return False
+
+        # Cache the row as stored, not as the caller built it.
+        character.created_at = created_at
+        _remember(character)
+        return True
+
     @staticmethod
+    @observe_query
     async def get_by_id(id: UUID) -> Optional[Character]:
-        pool = await Postgres.pool()
+        character = _characters.get(id)
+        if character is not None:
+            return character.model_copy()
 
-        async with pool.acquire() as conn:
+        # The row is cached until a notification drops it, so it is read
+        # from the primary: a lagging replica would cache the old one.
+        async with Postgres.acquire(readonly=True, replica=False) as conn:
             query = ("SELECT id, name, description, created_at "
                      "FROM characters WHERE id = $1")
             row = await conn.fetchrow(query, id)
-            return Character(**row) if row else None
+            return _remember(Character(**row)) if row else None
+
+    @staticmethod
+    @observe_query
+    async def get_existing_ids(ids: Iterable[UUID]) -> Set[UUID]:
+        async with Postgres.acquire() as conn:
+            query = "SELECT id FROM characters WHERE id = ANY($1::uuid[])"
+            rows = await conn.fetch(query, list(ids))
+            return {row["id"] for row in rows}
 
     @staticmethod
-    async def get_by_name(name: str) -> Optional[Character]:
-        pool = await Postgres.pool()
+    @observe_query
+    @retry_on_primary
+    async def list(
+            limit: Optional[int] = None,
+            after: Optional[Tuple[str, UUID]] = None
+    ) -> List[Record]:
+        condition = ""
+        args = []
+        if after is not None:
+            args.extend(after)
+            condition = 'WHERE (name COLLATE "C", id) > ($1, $2) '
+
+        pagination = ""
+        if limit is not None:
+            args.append(limit)
+            pagination = f" LIMIT ${len(args)}"
 
-        async with pool.acquire() as conn:
+        async with Postgres.acquire(readonly=True) as conn:
             query = ("SELECT id, name, description, created_at "
-                     "FROM characters WHERE name = $1")
-            row = await conn.fetchrow(query, name)
-            return Character(**row) if row else None
+                     f"FROM characters {condition}"
+                     f'ORDER BY name COLLATE "C", id{pagination}')
+            return await conn.fetch(query, *args)
 
     @staticmethod
-    async def list() -> List[Character]:
-        pool = await Postgres.pool()
+    @observe_query
+    @retry_on_primary
+    async def list_ids(limit: int, after: Optional[UUID] = None) -> List[UUID]:
+        args: List[Any] = [limit]
+        condition = ""
+        if after is not None:
+            args.append(after)
+            condition = "WHERE id > $2 "
 
-        async with pool.acquire() as conn:
-            query = ("SELECT id, name, description, created_at "
-                     "FROM characters ORDER BY name")
-            rows = await conn.fetch(query)
-            return [Character(**row) for row in rows]
+        async with Postgres.acquire(readonly=True) as conn:
+            query = (f"SELECT id FROM characters {condition}"
+                     "ORDER BY id LIMIT $1")
+            rows = await conn.fetch(query, *args)
+            return [row["id"] for row in rows]
+
+    @staticmethod
+    @observe_query
+    @retry_on_primary
+    async def search(query: str, limit: int) -> List[Record]:
+        # Byte-wise ordering (USING ~<~) follows the prefix index,
+        # so the prefix branch stops after limit rows however many match.
+        prefix_query = (
+            "SELECT id, name, description, created_at{} "
+            f"FROM characters WHERE {_PREFIX_CONDITION} "
+            'ORDER BY name_folded USING ~<~, name COLLATE "C", id LIMIT $3')
+
+        async with Postgres.acquire(readonly=True) as conn:
+            if PostgresCharactersRepository._trigrams is None:
+                PostgresCharactersRepository._trigrams = await conn.fetchval(
+                    "SELECT to_regclass('characters_name_trgm_idx') "
+                    "IS NOT NULL")
+
+            if len(query) < SEARCH_FUZZY_MIN_LENGTH \
+                    or not PostgresCharactersRepository._trigrams:
+                return await conn.fetch(prefix_query.format(""), query,
+                                        _PREFIX_END, limit)
+
+            ranked_prefix_query = prefix_query.format(
+                ", name_folded, 0 AS rank")
+            fuzzy_query = (
+                "SELECT id, name, description, created_at, name_folded, "
+                "1 - word_similarity(fold_name($1), name_folded) AS rank "
+                "FROM characters WHERE fold_name($1) <% name_folded "
+                f"AND NOT ({_PREFIX_CONDITION}) "
+                "ORDER BY rank, name_folded USING ~<~, "
+                'name COLLATE "C", id LIMIT $3')
+            async with conn.transaction(readonly=True):
+                await conn.execute(
+                    "SELECT set_config('pg_trgm.word_similarity_threshold', "
+                    "$1, true)", str(SEARCH_THRESHOLD))
+                return await conn.fetch(
+                    "SELECT id, name, description, created_at "
+                    f"FROM (({ranked_prefix_query}) UNION ALL "
+                    f"({fuzzy_query})) matches "
+                    "ORDER BY rank, name_folded USING ~<~, "
+                    'name COLLATE "C", id LIMIT $3',
+                    query, _PREFIX_END, limit)
+
+    @staticmethod
+    @observe_query
+    @retry_on_primary
+    async def get_with_locations(
+            ids: List[UUID],
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        args: List[Any] = [ids]
+        conditions = ["character_id = c.id",
+                      *_period_conditions(start, end, args)]
+        pagination = ""
+        if limit is not None:
+            args.append(limit)
+            pagination = f" LIMIT ${len(args)}"
+
+        # array_agg keeps the locations typed: asyncpg decodes the rows
+        # as tuples, where json_agg would be parsed back from text.
+        async with Postgres.acquire(readonly=True) as conn:
+            query = (
+                "SELECT c.id, c.name, c.description, c.created_at, "
+                "t.locations "
+                "FROM unnest($1::uuid[]) WITH ORDINALITY AS k (id, n) "
+                "JOIN characters c ON c.id = k.id "
+                "CROSS JOIN LATERAL ("
+                "SELECT array_agg(l ORDER BY l.created_at, l.id) "
+                "AS locations FROM ("
+                "SELECT id, character_id, x, y, created_at "
+                f"FROM locations WHERE {' AND '.join(conditions)} "
+                f"ORDER BY created_at, id{pagination}) l) t "
+                "ORDER BY k.n")
+            rows = await conn.fetch(query, *args)
+
+        return [{
+            "id": row["id"],
+            "name": row["name"],
+            "description": row["description"],
+            "created_at": row["created_at"],
+            "locations": [dict(zip(_LOCATION_KEYS, location))
+                          for location in row["locations"] or ()]
+        } for row in rows]
 
     @staticmethod
-    async def update(character: Character) -> None:
-        pool = await Postgres.pool()
+    @observe_query
+    async def update(id: UUID, name: str,
+                     description: Optional[str]) -> Optional[Character]:
+        async with Postgres.acquire() as conn:
+            query = ("UPDATE characters SET name = $1, description = $2 "
+                     "WHERE id = $3 "
+                     "RETURNING id, name, description, created_at")
+            try:
+                row = await conn.fetchrow(query, name, description, id)
+            except UniqueViolationError:
+                raise DuplicateName()
 
-        async with pool.acquire() as conn:
-            query = ("UPDATE characters SET name = $1, description = $2, "
-                     "created_at = $3 WHERE id = $4")
-            await conn.execute(
-                query, character.name, character.description,
-                character.created_at, character.id)
+        if row is None:
+            _characters.delete(id)
+            return None
+
+        return _remember(Character(**row))
+
+    @staticmethod
+    @observe_query
+    async def delete(id: UUID) -> bool:
+        async with Postgres.acquire() as conn:
+            query = "DELETE FROM characters WHERE id = $1 RETURNING id"
+            deleted = await conn.fetchval(query, id)
+
+        _characters.delete(id)
+        return deleted is not None
+
+    @staticmethod
+    @observe_query
+    @retry_on_primary
+    async def get_version() -> Optional[Version]:
+        async with Postgres.acquire(readonly=True) as conn:
+            query = ("SELECT version, updated_at FROM collection_versions "
+                     "WHERE collection = 'characters'")
+            row = await conn.fetchrow(query)
+            return tuple(row) if row else None
+
+    @staticmethod
+    def clear_cache() -> None:
+        _characters.clear()
 
     @staticmethod
-    async def delete(id: UUID) -> None:
-        pool = await Postgres.pool()
+    def invalidate(payload: str) -> None:
+        """Drops characters updated or deleted through any connection, as
+        sent by the characters_notify triggers: comma separated ids, or *
+        for everything."""
+        if payload == "*":
+            PostgresCharactersRepository.clear_cache()
+            return
 
-        async with pool.acquire() as conn:
-            query = "DELETE FROM characters WHERE id = $1"
-            await conn.execute(query, id)
+        for id in payload.split(","):
+            _characters.delete(UUID(id))
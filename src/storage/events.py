@@ -0,0 +1,105 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+from typing import Dict, Optional, Set
+from uuid import UUID
+
+import orjson
+
+from src.monitoring.metrics import Gauge
+from src.storage.base import Row
+
+QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "1000"))
+
+
+class Subscription:
+    """Queue of ready-to-send server-sent events of one client.
+
+    A client that falls more than QUEUE_SIZE events behind is dropped: its
+    queue is replaced by a single None, which ends the stream, so that it
+    reconnects and reloads the history instead of silently missing
+    locations.
+    """
+
+    def __init__(self, character_id: Optional[UUID]):
+        self.character_id = character_id
+        self.queue: asyncio.Queue[Optional[bytes]] = asyncio.Queue(QUEUE_SIZE)
+
+    def push(self, message: bytes) -> bool:
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            return False
+
+
+class LocationEvents:
+    """Fans committed locations out to subscribers.
+
+    Every event is serialized once, however many clients receive it. The
+    Postgres backend feeds it from one LISTEN connection, the in-memory
+    backend on every write.
+    """
+
+    _subscriptions: Dict[Optional[UUID], Set[Subscription]] = {}
+
+    @staticmethod
+    def subscribe(character_id: Optional[UUID] = None) -> Subscription:
+        """Subscribes to one character's locations, or to all of them."""
+        subscription = Subscription(character_id)
+        LocationEvents._subscriptions.setdefault(
+            character_id, set()).add(subscription)
+        return subscription
+
+    @staticmethod
+    def unsubscribe(subscription: Subscription) -> None:
+        subscriptions = LocationEvents._subscriptions.get(
+            subscription.character_id)
+        if subscriptions is None:
+            return
+
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del LocationEvents._subscriptions[subscription.character_id]
+
+    @staticmethod
+    def publish(row: Row) -> None:
+        recipients = [
+            *LocationEvents._subscriptions.get(row["character_id"], ()),
+            *LocationEvents._subscriptions.get(None, ()),
+        ]
+        if not recipients:
+            return
+
+        data = orjson.dumps(dict(row), default=str,
+                            option=orjson.OPT_UTC_Z)
+        message = (b"id: " + str(row["id"]).encode()
+                   + b"\nevent: location\ndata: " + data + b"\n\n")
+        for subscription in recipients:
+            if not subscription.push(message):
+                LocationEvents.unsubscribe(subscription)
+
+    @staticmethod
+    def publish_notification(payload: str) -> None:
+        """Publishes locations batched by the locations_notify trigger."""
+        for row in json.loads(payload):
+            LocationEvents.publish({
+                "id": UUID(row["id"]),
+                "character_id": UUID(row["character_id"]),
+                "x": row["x"],
+                "y": row["y"],
+                "created_at": datetime.fromisoformat(row["created_at"]),
+            })
+
+    @staticmethod
+    def count() -> int:
+        return sum(len(subscriptions) for subscriptions
+                   in LocationEvents._subscriptions.values())
+
+
+Gauge("live_subscriptions", "Open location stream subscriptions", (),
+      lambda: [((), LocationEvents.count())])
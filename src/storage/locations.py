@@ -1,68 +1,312 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from uuid import UUID
 
-from pydantic import BaseModel
+from asyncpg import ForeignKeyViolationError, Record
 
-from src.database.postgres import Postgres
+from src.database.postgres import Postgres, retry_on_primary
+from src.monitoring.metrics import observe_query
+from src.storage.base import (Location, LocationsRepository, MissingCharacter,
+                              Version)
 
 
-class Location(BaseModel):
-    id: UUID
-    character_id: UUID
-    x: float
-    y: float
-    created_at: datetime
+def _period_conditions(
+        start: Optional[datetime],
+        end: Optional[datetime],
+        args: List[Any]
+) -> List[str]:
+    conditions = []
+    if start is not None:
+        args.append(start)
+        conditions.append(f"created_at >= ${len(args)}")
+    if end is not None:
+        args.append(end)
+        conditions.append(f"created_at <= ${len(args)}")
+    return conditions
 
 
-class LocationsRepository:
+class PostgresLocationsRepository(LocationsRepository):
     @staticmethod
+    @observe_query
     async def create(location: Location) -> None:
-        pool = await Postgres.pool()
-
-        async with pool.acquire() as conn:
+        async with Postgres.acquire() as conn:
             query = ("INSERT INTO locations (id, character_id, x, y, "
                      "created_at) VALUES ($1, $2, $3, $4, $5)")
-            await conn.execute(
-                query, location.id, location.character_id,
-                location.x, location.y, location.created_at)
+            try:
+                await conn.execute(
+                    query, location.id, location.character_id,
+                    location.x, location.y, location.created_at)
+            except ForeignKeyViolationError:
+                raise MissingCharacter(location.character_id)
 
     @staticmethod
-    async def get_by_id(id: UUID) -> Optional[Location]:
-        pool = await Postgres.pool()
+    @observe_query
+    async def create_many(locations: List[Location]) -> None:
+        async with Postgres.acquire() as conn:
+            try:
+                await conn.copy_records_to_table(
+                    "locations",
+                    records=[
+                        (location.id, location.character_id, location.x,
+                         location.y, location.created_at)
+                        for location in locations
+                    ],
+                    columns=["id", "character_id", "x", "y", "created_at"])
+            except ForeignKeyViolationError:
+                raise MissingCharacter()
 
-        async with pool.acquire() as conn:
+    @staticmethod
+    @observe_query
+    @retry_on_primary
+    async def get_by_id(id: UUID) -> Optional[Location]:
+        async with Postgres.acquire(readonly=True) as conn:
             query = ("SELECT id, character_id, x, y, created_at "
                      "FROM locations WHERE id = $1")
             row = await conn.fetchrow(query, id)
             return Location(**row) if row else None
 
     @staticmethod
-    async def get_by_character_id(character_id: UUID) -> List[Location]:
-        pool = await Postgres.pool()
+    @observe_query
+    @retry_on_primary
+    async def get_by_character_id(
+            character_id: UUID,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            limit: Optional[int] = None,
+            after: Optional[Tuple[datetime, UUID]] = None
+    ) -> List[Record]:
+        args: List[Any] = [character_id]
+        conditions = ["character_id = $1",
+                      *_period_conditions(start, end, args)]
+        if after is not None:
+            args.extend(after)
+            # The plain bound lets Postgres skip the earlier partitions.
+            conditions.append(f"created_at >= ${len(args) - 1}")
+            conditions.append(
+                f"(created_at, id) > (${len(args) - 1}, ${len(args)})")
 
-        async with pool.acquire() as conn:
+        pagination = ""
+        if limit is not None:
+            args.append(limit)
+            pagination = f" LIMIT ${len(args)}"
+
+        async with Postgres.acquire(readonly=True) as conn:
             query = ("SELECT id, character_id, x, y, created_at "
-                     "FROM locations WHERE character_id = $1 "
-                     "ORDER BY created_at")
-            rows = await conn.fetch(query, character_id)
-            return [Location(**row) for row in rows]
+                     f"FROM locations WHERE {' AND '.join(conditions)} "
+                     f"ORDER BY created_at, id{pagination}")
+            return await conn.fetch(query, *args)
 
     @staticmethod
-    async def list() -> List[Location]:
-        pool = await Postgres.pool()
+    @observe_query
+    @retry_on_primary
+    async def get_track(
+            character_id: UUID,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            max_rows: Optional[int] = None
+    ) -> List[Record]:
+        args: List[Any] = [character_id]
+        conditions = ' AND '.join(["character_id = $1",
+                                   *_period_conditions(start, end, args)])
+
+        async with Postgres.acquire(readonly=True) as conn:
+            reduce = False
+            if max_rows is not None:
+                # Counts at most max_rows + 1 index entries.
+                query = ("SELECT count(*) FROM (SELECT FROM locations "
+                         f"WHERE {conditions} LIMIT ${len(args) + 1}) t")
+                reduce = await conn.fetchval(
+                    query, *args, max_rows + 1) > max_rows
+
+            if not reduce:
+                query = ("SELECT id, character_id, x, y, created_at "
+                         f"FROM locations WHERE {conditions} "
+                         "ORDER BY created_at, id")
+                return await conn.fetch(query, *args)
 
-        async with pool.acquire() as conn:
+            # Only one location per bucket leaves the database.
+            buckets = f"${len(args) + 1}::int"
+            query = (
+                "WITH bounds AS ("
+                "SELECT date_part('epoch', min(created_at)) AS low, "
+                "greatest(date_part('epoch', max(created_at)) "
+                "- date_part('epoch', min(created_at)), 1e-6) AS span "
+                f"FROM locations WHERE {conditions}), "
+                "track AS ("
+                "SELECT id, character_id, x, y, created_at, "
+                "least(floor((date_part('epoch', created_at) - low) "
+                f"* {buckets} / span)::int, {buckets} - 1) AS bucket "
+                f"FROM locations, bounds WHERE {conditions}), "
+                "centered AS ("
+                "SELECT *, avg(x) OVER bucket AS mean_x, "
+                "avg(y) OVER bucket AS mean_y FROM track "
+                "WINDOW bucket AS (PARTITION BY bucket)) "
+                "(SELECT DISTINCT ON (bucket) "
+                "id, character_id, x, y, created_at FROM centered "
+                "ORDER BY bucket, (x - mean_x) ^ 2 + (y - mean_y) ^ 2, "
+                "created_at, id) "
+                "UNION (SELECT id, character_id, x, y, created_at "
+                f"FROM locations WHERE {conditions} "
+                "ORDER BY created_at, id LIMIT 1) "
+                "UNION (SELECT id, character_id, x, y, created_at "
+                f"FROM locations WHERE {conditions} "
+                "ORDER BY created_at DESC, id DESC LIMIT 1) "
+                "ORDER BY created_at, id")
+            args.append(max_rows)
+            return await conn.fetch(query, *args)
+
+    @staticmethod
+    async def iterate_by_character_id(
+            character_id: UUID,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            prefetch: int = 1000
+    ) -> AsyncIterator[Record]:
+        args: List[Any] = [character_id]
+        conditions = ["character_id = $1",
+                      *_period_conditions(start, end, args)]
+
+        async with Postgres.acquire(readonly=True) as conn:
+            async with conn.transaction(readonly=True):
+                query = ("SELECT id, character_id, x, y, created_at "
+                         f"FROM locations WHERE {' AND '.join(conditions)} "
+                         "ORDER BY created_at, id")
+                async for row in conn.cursor(query, *args,
+                                             prefetch=prefetch):
+                    yield row
+
+    @staticmethod
+    @observe_query
+    @retry_on_primary
+    async def get_within(
+            x_min: float,
+            y_min: float,
+            x_max: float,
+            y_max: float,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            limit: Optional[int] = None,
+            after: Optional[Tuple[datetime, UUID]] = None
+    ) -> List[Record]:
+        args: List[Any] = [x_min, y_min, x_max, y_max]
+        conditions = ["point(x, y) <@ box(point($1, $2), point($3, $4))",
+                      *_period_conditions(start, end, args)]
+        if after is not None:
+            args.extend(after)
+            # The plain bound lets Postgres skip the earlier partitions.
+            conditions.append(f"created_at >= ${len(args) - 1}")
+            conditions.append(
+                f"(created_at, id) > (${len(args) - 1}, ${len(args)})")
+
+        pagination = ""
+        if limit is not None:
+            args.append(limit)
+            pagination = f" LIMIT ${len(args)}"
+
+        async with Postgres.acquire(readonly=True) as conn:
+            query = ("SELECT id, character_id, x, y, created_at "
+                     f"FROM locations WHERE {' AND '.join(conditions)} "
+                     f"ORDER BY created_at, id{pagination}")
+            return await conn.fetch(query, *args)
+
+    @staticmethod
+    @observe_query
+    @retry_on_primary
+    async def get_nearest(
+            x: float,
+            y: float,
+            limit: int,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None
+    ) -> List[Record]:
+        args: List[Any] = [x, y, limit]
+        conditions = _period_conditions(start, end, args)
+        condition = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+
+        async with Postgres.acquire(readonly=True) as conn:
+            query = ("SELECT id, character_id, x, y, created_at "
+                     f"FROM locations {condition}"
+                     "ORDER BY point(x, y) <-> point($1, $2) LIMIT $3")
+            return await conn.fetch(query, *args)
+
+    @staticmethod
+    @observe_query
+    @retry_on_primary
+    async def get_stats(
+            character_ids: List[UUID],
+            bucket: str,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None
+    ) -> List[Dict[str, Any]]:
+        args: List[Any] = [bucket, character_ids]
+        conditions = ["character_id = ANY($2::uuid[])",
+                      *_period_conditions(start, end, args)]
+
+        # One ordered pass over the (character_id, created_at, id) index:
+        # lag() pairs every point with the previous one and the grouping
+        # sets give the totals (bucket NULL) and the buckets at once.
+        async with Postgres.acquire(readonly=True) as conn:
+            query = (
+                "WITH steps AS ("
+                "SELECT character_id, x, y, created_at, "
+                "date_trunc($1, created_at, 'UTC') AS bucket, "
+                "point(x, y) <-> lag(point(x, y)) OVER w AS step, "
+                "extract(epoch FROM created_at - lag(created_at) OVER w) "
+                "AS seconds "
+                f"FROM locations WHERE {' AND '.join(conditions)} "
+                "WINDOW w AS (PARTITION BY character_id "
+                "ORDER BY created_at, id)) "
+                "SELECT character_id, bucket, count(*) AS points, "
+                "coalesce(sum(step), 0) AS distance, "
+                "coalesce(sum(step), 0) / nullif(extract(epoch FROM "
+                "max(created_at) - min(created_at)), 0) AS average_speed, "
+                "max(step / seconds) FILTER (WHERE seconds > 0) "
+                "AS max_speed, "
+                "min(x) AS x_min, min(y) AS y_min, "
+                "max(x) AS x_max, max(y) AS y_max, "
+                "min(created_at) AS first_at, max(created_at) AS last_at "
+                "FROM steps "
+                "GROUP BY GROUPING SETS ((character_id), "
+                "(character_id, bucket)) "
+                "ORDER BY character_id, bucket NULLS FIRST")
+            rows = await conn.fetch(query, *args)
+
+        stats: List[Dict[str, Any]] = []
+        for row in rows:
+            stat = dict(row)
+            bucket_start = stat.pop("bucket")
+            if bucket_start is None:
+                stats.append({**stat, "buckets": []})
+            else:
+                stats[-1]["buckets"].append({"start": bucket_start,
+                                             "points": stat["points"],
+                                             "distance": stat["distance"]})
+        return stats
+
+    @staticmethod
+    @observe_query
+    @retry_on_primary
+    async def get_last_locations() -> List[Record]:
+        async with Postgres.acquire(readonly=True) as conn:
+            query = ("SELECT location_id AS id, character_id, x, y, "
+                     "created_at FROM character_last_location "
+                     "ORDER BY character_id")
+            return await conn.fetch(query)
+
+    @staticmethod
+    @observe_query
+    @retry_on_primary
+    async def list() -> List[Location]:
+        async with Postgres.acquire(readonly=True) as conn:
             query = ("SELECT id, character_id, x, y, created_at "
                      "FROM locations ORDER BY created_at")
             rows = await conn.fetch(query)
             return [Location(**row) for row in rows]
 
     @staticmethod
+    @observe_query
     async def update(location: Location) -> None:
-        pool = await Postgres.pool()
-
-        async with pool.acquire() as conn:
+        async with Postgres.acquire() as conn:
             query = ("UPDATE locations SET character_id = $1, "
                      "x = $2, y = $3, created_at = $4 WHERE id = $5")
             await conn.execute(
@@ -70,9 +314,37 @@ class LocationsRepository:
                 location.y, location.created_at, location.id)
 
     @staticmethod
-    async def delete(id: UUID) -> None:
-        pool = await Postgres.pool()
+    @observe_query
+    async def delete(id: UUID) -> bool:
+        async with Postgres.acquire() as conn:
+            query = "DELETE FROM locations WHERE id = $1 RETURNING id"
+            return await conn.fetchval(query, id) is not None
 
-        async with pool.acquire() as conn:
-            query = "DELETE FROM locations WHERE id = $1"
-            await conn.execute(query, id)
+    @staticmethod
+    @observe_query
+    async def create_partitions(ahead: int) -> int:
+        """Creates the monthly partitions up to ahead months from now."""
+        async with Postgres.acquire() as conn:
+            return await conn.fetchval(
+                "SELECT ensure_locations_partitions($1)", ahead)
+
+    @staticmethod
+    @observe_query
+    async def drop_partitions(keep: int, archive: bool = False) -> int:
+        """Drops (or detaches, with archive) locations older than keep
+        whole months before the current one."""
+        async with Postgres.acquire() as conn:
+            query = ("SELECT drop_locations_partitions(("
+                     "date_trunc('month', now() AT TIME ZONE 'UTC') "
+                     "- make_interval(months => $1)) AT TIME ZONE 'UTC', $2)")
+            return await conn.fetchval(query, keep, archive)
+
+    @staticmethod
+    @observe_query
+    @retry_on_primary
+    async def get_version(character_id: UUID) -> Optional[Version]:
+        async with Postgres.acquire(readonly=True) as conn:
+            query = ("SELECT version, updated_at FROM collection_versions "
+                     "WHERE collection = $1")
+            row = await conn.fetchrow(query, f"locations:{character_id}")
+            return tuple(row) if row else None
@@ -0,0 +1,534 @@
+import heapq
+import re
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timezone
+from itertools import groupby, product
+from math import floor, isfinite
+from types import MappingProxyType
+from typing import (Any, AsyncIterator, Dict, Iterable, List, Optional, Set,
+                    Tuple)
+from uuid import UUID
+
+from src.analytics.movement import movement_stats
+from src.storage.base import (SEARCH_FUZZY_MIN_LENGTH, SEARCH_THRESHOLD,
+                              Character, CharactersRepository, DuplicateName,
+                              Location, LocationsRepository, MissingCharacter,
+                              Row, Version)
+from src.storage.events import LocationEvents
+
+_MIN_ID = UUID(int=0)
+_MAX_ID = UUID(int=(1 << 128) - 1)
+
+# Side of the square cells locations are bucketed by for get_within and
+# get_nearest. Queries visit the cells they overlap, or every occupied cell
+# when that is fewer, so the size only trades memory for precision.
+_CELL_SIZE = 10.0
+
+Cell = Optional[Tuple[int, int]]
+
+
+def _trigrams(text: str) -> Set[str]:
+    # Like pg_trgm: every word is padded with two spaces in front and one
+    # after.
+    trigrams = set()
+    for word in re.findall(r"\w+", text.lower()):
+        padded = f"  {word} "
+        trigrams.update(padded[i:i + 3] for i in range(len(word) + 1))
+    return trigrams
+
+
+def _cell(x: float, y: float) -> Cell:
+    # Non-finite coordinates share the None cell, which only full scans
+    # visit: no finite box or distance can select them otherwise.
+    if not (isfinite(x) and isfinite(y)):
+        return None
+    return floor(x / _CELL_SIZE), floor(y / _CELL_SIZE)
+
+
+def _ring(center: Tuple[int, int], radius: int) -> Iterable[Tuple[int, int]]:
+    """Cells exactly radius cells away from center."""
+    cx, cy = center
+    if radius == 0:
+        yield center
+        return
+    for i in range(-radius, radius + 1):
+        yield cx + i, cy - radius
+        yield cx + i, cy + radius
+    for i in range(-radius + 1, radius):
+        yield cx - radius, cy + i
+        yield cx + radius, cy + i
+
+
+def _utc(value: datetime) -> datetime:
+    # Matches timestamptz: naive values are taken as local time and
+    # everything is returned in UTC.
+    return value.astimezone(timezone.utc)
+
+
+class _Track:
+    """Locations of one character, sorted by (created_at, id)."""
+
+    def __init__(self):
+        self.keys: List[Tuple[datetime, UUID]] = []
+        self.rows: List[Row] = []
+
+    def add(self, row: Row) -> None:
+        key = (row["created_at"], row["id"])
+        index = bisect_right(self.keys, key)
+        self.keys.insert(index, key)
+        self.rows.insert(index, row)
+
+    def remove(self, row: Row) -> None:
+        index = bisect_left(self.keys, (row["created_at"], row["id"]))
+        del self.keys[index]
+        del self.rows[index]
+
+    def slice(self, start: Optional[datetime], end: Optional[datetime],
+              after: Optional[Tuple[datetime, UUID]] = None) -> List[Row]:
+        low = 0 if start is None \
+            else bisect_left(self.keys, (_utc(start), _MIN_ID))
+        if after is not None:
+            low = max(low, bisect_right(self.keys,
+                                        (_utc(after[0]), after[1])))
+        high = len(self.keys) if end is None \
+            else bisect_right(self.keys, (_utc(end), _MAX_ID))
+        return self.rows[low:high]
+
+
+class Memory:
+    """In-process dataset with the same constraints as the Postgres schema:
+    unique names, existing characters for locations and cascade delete.
+
+    Rows are stored as read-only mappings and handed out without copying.
+    Mutations never await, so they are atomic within the event loop."""
+
+    characters: Dict[UUID, Row] = {}
+    names: Dict[str, UUID] = {}
+    order: List[Tuple[str, UUID]] = []
+    lowered: List[Tuple[str, str, UUID]] = []
+    trigrams: Dict[str, Set[UUID]] = {}
+    locations: Dict[UUID, Row] = {}
+    tracks: Dict[UUID, _Track] = {}
+    cells: Dict[Cell, Dict[UUID, Row]] = {}
+    versions: Dict[str, Version] = {}
+    version = 0
+
+    @staticmethod
+    def reset() -> None:
+        Memory.characters = {}
+        Memory.names = {}
+        Memory.order = []
+        Memory.lowered = []
+        Memory.trigrams = {}
+        Memory.locations = {}
+        Memory.tracks = {}
+        Memory.cells = {}
+        Memory.versions = {}
+
+    @staticmethod
+    def bump(collection: str) -> None:
+        # One counter for all collections, like the Postgres sequence, so
+        # a version is never reused after a reset.
+        Memory.version += 1
+        Memory.versions[collection] = (Memory.version,
+                                       datetime.now(timezone.utc))
+
+    @staticmethod
+    def stats() -> Dict[str, int]:
+        return {"characters": len(Memory.characters),
+                "locations": len(Memory.locations)}
+
+    @staticmethod
+    def add_character(character: Character) -> Row:
+        row = MappingProxyType({
+            "id": character.id,
+            "name": character.name,
+            "description": character.description,
+            "created_at": _utc(character.created_at),
+        })
+        Memory.characters[row["id"]] = row
+        Memory.names[row["name"]] = row["id"]
+        insort(Memory.order, (row["name"], row["id"]))
+        insort(Memory.lowered, (row["name"].lower(), row["name"], row["id"]))
+        for trigram in _trigrams(row["name"]):
+            Memory.trigrams.setdefault(trigram, set()).add(row["id"])
+        Memory.bump("characters")
+        return row
+
+    @staticmethod
+    def remove_character(row: Row) -> None:
+        del Memory.characters[row["id"]]
+        del Memory.names[row["name"]]
+        del Memory.order[bisect_left(Memory.order, (row["name"], row["id"]))]
+        del Memory.lowered[bisect_left(
+            Memory.lowered, (row["name"].lower(), row["name"], row["id"]))]
+        for trigram in _trigrams(row["name"]):
+            ids = Memory.trigrams[trigram]
+            ids.discard(row["id"])
+            if not ids:
+                del Memory.trigrams[trigram]
+        Memory.bump("characters")
+
+    @staticmethod
+    def check_location(location: Location) -> None:
+        if location.character_id not in Memory.characters:
+            raise MissingCharacter(location.character_id)
+
+    @staticmethod
+    def add_location(location: Location) -> Row:
+        row = MappingProxyType({
+            "id": location.id,
+            "character_id": location.character_id,
+            "x": location.x,
+            "y": location.y,
+            "created_at": _utc(location.created_at),
+        })
+        Memory.locations[row["id"]] = row
+        track = Memory.tracks.get(row["character_id"])
+        if track is None:
+            track = Memory.tracks[row["character_id"]] = _Track()
+        track.add(row)
+        Memory.cells.setdefault(_cell(row["x"], row["y"]), {})[row["id"]] = row
+        Memory.bump(f"locations:{row['character_id']}")
+        return row
+
+    @staticmethod
+    def remove_location(row: Row) -> None:
+        del Memory.locations[row["id"]]
+        track = Memory.tracks[row["character_id"]]
+        track.remove(row)
+        if not track.keys:
+            del Memory.tracks[row["character_id"]]
+        Memory.uncell(row)
+        Memory.bump(f"locations:{row['character_id']}")
+
+    @staticmethod
+    def uncell(row: Row) -> None:
+        cell = _cell(row["x"], row["y"])
+        rows = Memory.cells[cell]
+        del rows[row["id"]]
+        if not rows:
+            del Memory.cells[cell]
+
+    @staticmethod
+    def track(character_id: UUID, start: Optional[datetime],
+              end: Optional[datetime],
+              after: Optional[Tuple[datetime, UUID]] = None) -> List[Row]:
+        track = Memory.tracks.get(character_id)
+        return track.slice(start, end, after) if track is not None else []
+
+    @staticmethod
+    def scan(start: Optional[datetime], end: Optional[datetime],
+             cells: Optional[Iterable[Cell]] = None) -> Iterable[Row]:
+        """Locations of the period in the given cells, or in all of them."""
+        start = _utc(start) if start is not None else None
+        end = _utc(end) if end is not None else None
+        buckets = Memory.cells.values() if cells is None \
+            else (Memory.cells[cell] for cell in cells
+                  if cell in Memory.cells)
+        for rows in buckets:
+            for row in rows.values():
+                if start is not None and row["created_at"] < start:
+                    continue
+                if end is not None and row["created_at"] > end:
+                    continue
+                yield row
+
+
+def _by_time(row: Row) -> Tuple[datetime, UUID]:
+    return row["created_at"], row["id"]
+
+
+class MemoryCharactersRepository(CharactersRepository):
+    @staticmethod
+    async def create(character: Character) -> bool:
+        if character.name in Memory.names:
+            return False
+
+        row = Memory.add_character(character)
+        character.created_at = row["created_at"]
+        return True
+
+    @staticmethod
+    async def get_by_id(id: UUID) -> Optional[Character]:
+        row = Memory.characters.get(id)
+        return Character(**row) if row else None
+
+    @staticmethod
+    async def get_existing_ids(ids: Iterable[UUID]) -> Set[UUID]:
+        return {id for id in ids if id in Memory.characters}
+
+    @staticmethod
+    async def list(
+            limit: Optional[int] = None,
+            after: Optional[Tuple[str, UUID]] = None
+    ) -> List[Row]:
+        start = bisect_right(Memory.order, tuple(after)) if after else 0
+        end = start + limit if limit is not None else None
+        return [Memory.characters[id]
+                for _, id in Memory.order[start:end]]
+
+    @staticmethod
+    async def list_ids(limit: int, after: Optional[UUID] = None) -> List[UUID]:
+        return heapq.nsmallest(limit, (
+            id for id in Memory.characters if after is None or id > after))
+
+    @staticmethod
+    async def get_with_locations(
+            ids: List[UUID],
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        characters = []
+        for id in ids:
+            row = Memory.characters.get(id)
+            if row is None:
+                continue
+            locations = Memory.track(id, start, end)
+            characters.append({
+                **row,
+                "locations": locations[:limit] if limit is not None
+                else locations
+            })
+        return characters
+
+    @staticmethod
+    async def search(query: str, limit: int) -> List[Row]:
+        prefix = query.lower()
+        start = bisect_left(Memory.lowered, (prefix,))
+        matches = []
+        for lowered, _, id in Memory.lowered[start:start + limit]:
+            if not lowered.startswith(prefix):
+                break
+            matches.append(Memory.characters[id])
+        if len(matches) == limit or len(query) < SEARCH_FUZZY_MIN_LENGTH:
+            return matches
+
+        # Like word_similarity(): the share of the query's trigrams found
+        # in the name.
+        trigrams = _trigrams(query)
+        shared: Dict[UUID, int] = {}
+        for trigram in trigrams:
+            for id in Memory.trigrams.get(trigram, ()):
+                shared[id] = shared.get(id, 0) + 1
+        ranked = []
+        for id, count in shared.items():
+            row = Memory.characters[id]
+            similarity = count / len(trigrams)
+            if similarity >= SEARCH_THRESHOLD \
+                    and not row["name"].lower().startswith(prefix):
+                ranked.append((-similarity, row["name"].lower(),
+                               row["name"], id))
+        matches.extend(Memory.characters[id] for *_, id in
+                       heapq.nsmallest(limit - len(matches), ranked))
+        return matches
+
+    @staticmethod
+    async def update(id: UUID, name: str,
+                     description: Optional[str]) -> Optional[Character]:
+        row = Memory.characters.get(id)
+        if row is None:
+            return None
+        if Memory.names.get(name, id) != id:
+            raise DuplicateName()
+
+        character = Character(**row)
+        character.name = name
+        character.description = description
+        Memory.remove_character(row)
+        Memory.add_character(character)
+        return character
+
+    @staticmethod
+    async def delete(id: UUID) -> bool:
+        row = Memory.characters.get(id)
+        if row is None:
+            return False
+
+        Memory.remove_character(row)
+        track = Memory.tracks.pop(id, None)
+        if track is not None:
+            for location in track.rows:
+                del Memory.locations[location["id"]]
+                Memory.uncell(location)
+        Memory.versions.pop(f"locations:{id}", None)
+        return True
+
+    @staticmethod
+    async def get_version() -> Optional[Version]:
+        return Memory.versions.get("characters")
+
+
+class MemoryLocationsRepository(LocationsRepository):
+    @staticmethod
+    async def create(location: Location) -> None:
+        Memory.check_location(location)
+        LocationEvents.publish(Memory.add_location(location))
+
+    @staticmethod
+    async def create_many(locations: List[Location]) -> None:
+        # Like COPY, either every location is stored or none is.
+        for location in locations:
+            Memory.check_location(location)
+        for location in locations:
+            LocationEvents.publish(Memory.add_location(location))
+
+    @staticmethod
+    async def get_by_id(id: UUID) -> Optional[Location]:
+        row = Memory.locations.get(id)
+        return Location(**row) if row else None
+
+    @staticmethod
+    async def get_by_character_id(
+            character_id: UUID,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            limit: Optional[int] = None,
+            after: Optional[Tuple[datetime, UUID]] = None
+    ) -> List[Row]:
+        rows = Memory.track(character_id, start, end, after)
+        return rows[:limit] if limit is not None else rows
+
+    @staticmethod
+    async def get_track(
+            character_id: UUID,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            max_rows: Optional[int] = None
+    ) -> List[Row]:
+        rows = Memory.track(character_id, start, end)
+        if max_rows is None or len(rows) <= max_rows:
+            return rows
+
+        low = rows[0]["created_at"].timestamp()
+        span = max(rows[-1]["created_at"].timestamp() - low, 1e-6)
+        reduced = [rows[0]]
+        for _, group in groupby(rows, lambda row: min(
+                floor((row["created_at"].timestamp() - low)
+                      * max_rows / span), max_rows - 1)):
+            group = list(group)
+            mean_x = sum(row["x"] for row in group) / len(group)
+            mean_y = sum(row["y"] for row in group) / len(group)
+            # min() keeps the earliest of equally near locations.
+            nearest = min(group, key=lambda row: (
+                (row["x"] - mean_x) ** 2 + (row["y"] - mean_y) ** 2))
+            if nearest is not reduced[-1]:
+                reduced.append(nearest)
+        if reduced[-1] is not rows[-1]:
+            reduced.append(rows[-1])
+        return reduced
+
+    @staticmethod
+    async def iterate_by_character_id(
+            character_id: UUID,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            prefetch: int = 1000
+    ) -> AsyncIterator[Row]:
+        # The slice is a snapshot, as the export transaction is in Postgres.
+        for row in Memory.track(character_id, start, end):
+            yield row
+
+    @staticmethod
+    async def get_within(
+            x_min: float,
+            y_min: float,
+            x_max: float,
+            y_max: float,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            limit: Optional[int] = None,
+            after: Optional[Tuple[datetime, UUID]] = None
+    ) -> List[Row]:
+        # box() orders its corners, so swapped bounds select the same area.
+        x_min, x_max = sorted((x_min, x_max))
+        y_min, y_max = sorted((y_min, y_max))
+        after = (_utc(after[0]), after[1]) if after is not None else None
+        low, high = _cell(x_min, y_min), _cell(x_max, y_max)
+        cells = None
+        if low is not None and high is not None and \
+                (high[0] - low[0] + 1) * (high[1] - low[1] + 1) \
+                < len(Memory.cells):
+            cells = product(range(low[0], high[0] + 1),
+                            range(low[1], high[1] + 1))
+        rows = [row for row in Memory.scan(start, end, cells)
+                if x_min <= row["x"] <= x_max and y_min <= row["y"] <= y_max
+                and (after is None or _by_time(row) > after)]
+        if limit is not None:
+            return heapq.nsmallest(limit, rows, key=_by_time)
+        return sorted(rows, key=_by_time)
+
+    @staticmethod
+    async def get_nearest(
+            x: float,
+            y: float,
+            limit: int,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None
+    ) -> List[Row]:
+        def distance(row: Row) -> float:
+            return (row["x"] - x) ** 2 + (row["y"] - y) ** 2
+
+        # Rings of cells around the point, until the limit-th nearest
+        # location is closer than any cell left outside them.
+        center = _cell(x, y)
+        rows = []
+        radius = 0
+        while center is not None \
+                and (2 * radius + 1) ** 2 < len(Memory.cells):
+            rows.extend(Memory.scan(start, end, _ring(center, radius)))
+            nearest = heapq.nsmallest(limit, rows, key=distance)
+            if len(nearest) == limit and \
+                    distance(nearest[-1]) <= (radius * _CELL_SIZE) ** 2:
+                return nearest
+            radius += 1
+
+        return heapq.nsmallest(limit, Memory.scan(start, end), key=distance)
+
+    @staticmethod
+    async def get_stats(
+            character_ids: List[UUID],
+            bucket: str,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None
+    ) -> List[Dict[str, Any]]:
+        stats = []
+        for id in sorted(set(character_ids)):
+            rows = Memory.track(id, start, end)
+            if rows:
+                stats.append({"character_id": id,
+                              **movement_stats(rows, bucket)})
+        return stats
+
+    @staticmethod
+    async def get_last_locations() -> List[Row]:
+        return [Memory.tracks[id].rows[-1] for id in sorted(Memory.tracks)]
+
+    @staticmethod
+    async def list() -> List[Location]:
+        return [Location(**row)
+                for row in sorted(Memory.locations.values(), key=_by_time)]
+
+    @staticmethod
+    async def update(location: Location) -> None:
+        row = Memory.locations.get(location.id)
+        if row is None:
+            return
+
+        Memory.check_location(location)
+        Memory.remove_location(row)
+        Memory.add_location(location)
+
+    @staticmethod
+    async def delete(id: UUID) -> bool:
+        row = Memory.locations.get(id)
+        if row is None:
+            return False
+
+        Memory.remove_location(row)
+        return True
+
+    @staticmethod
+    async def get_version(character_id: UUID) -> Optional[Version]:
+        return Memory.versions.get(f"locations:{character_id}")
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from src.storage.locations import PostgresLocationsRepository
+
+logger = logging.getLogger(__name__)
+
+
+class LocationsPartitions:
+    """Maintains the monthly partitions of locations in the background.
+
+    Every LOCATIONS_PARTITIONS_INTERVAL seconds it creates the partitions
+    for the next LOCATIONS_PARTITIONS_AHEAD months and, when
+    LOCATIONS_RETENTION_MONTHS is set, drops the ones that are older (or
+    only detaches them with LOCATIONS_RETENTION_ARCHIVE). Every worker runs
+    it, the database functions serialize on an advisory lock.
+    """
+
+    _task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    async def maintain() -> None:
+        ahead = int(os.getenv("LOCATIONS_PARTITIONS_AHEAD", "3"))
+        created = await PostgresLocationsRepository.create_partitions(ahead)
+        if created:
+            logger.info(f"Created {created} locations partitions")
+
+        retention = os.getenv("LOCATIONS_RETENTION_MONTHS")
+        if not retention:
+            return
+
+        archive = os.getenv("LOCATIONS_RETENTION_ARCHIVE", "false").lower() \
+            in ("1", "true")
+        dropped = await PostgresLocationsRepository.drop_partitions(
+            int(retention), archive)
+        if dropped:
+            logger.info(f"{'Detached' if archive else 'Dropped'} {dropped} "
+                        "locations partitions")
+
+    @staticmethod
+    def start() -> None:
+        LocationsPartitions._task = asyncio.create_task(
+            LocationsPartitions._run())
+
+    @staticmethod
+    async def stop() -> None:
+        task = LocationsPartitions._task
+        if task is None:
+            return
+
+        LocationsPartitions._task = None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    @staticmethod
+    async def _run() -> None:
+        interval = float(os.getenv("LOCATIONS_PARTITIONS_INTERVAL", "3600"))
+        while True:
+            try:
+                await LocationsPartitions.maintain()
+            except Exception as e:
+                logger.error(f"Locations partitions maintenance failed: {e}")
+            await asyncio.sleep(interval)
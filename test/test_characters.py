@@ -1,8 +1,16 @@
+import asyncio
+import contextvars
+import os
+import asyncpg
 import pytest
 
-from uuid import UUID
+from uuid import UUID, uuid4
 from httpx import AsyncClient
 
+from src.database.postgres import Postgres
+from src.storage.backend import Storage
+from src.storage.characters import PostgresCharactersRepository
+
 
 @pytest.mark.asyncio
 class TestCharacters:
@@ -21,10 +29,17 @@ class TestCharacters:
         assert "id" in data
         assert data["name"] == "Фродо Бэггинс"
         assert data["description"] == "Хоббит из Шира"
-        assert "created_at" in data
+        assert data["created_at"].endswith("Z")
 
         UUID(data["id"])
 
+        response = await client.get(f"/api/characters/{data['id']}")
+        assert response.json()["created_at"] == data["created_at"]
+
+        PostgresCharactersRepository.clear_cache()
+        response = await client.get(f"/api/characters/{data['id']}")
+        assert response.json()["created_at"] == data["created_at"]
+
     async def test_create_duplicate_name(self, client: AsyncClient):
         await client.post(
             "/api/characters",
@@ -72,6 +87,75 @@ class TestCharacters:
         assert response.status_code == 404
         assert response.json()["detail"] == "Character not found"
 
+    async def test_get_with_locations(self, client: AsyncClient):
+        create_response = await client.post(
+            "/api/characters",
+            json={"name": "Арагорн", "description": "Следопыт"}
+        )
+        character_id = create_response.json()["id"]
+
+        for day in (1, 2, 3, 4):
+            await client.post(
+                "/api/locations",
+                json={"character_id": character_id, "x": day, "y": -day,
+                      "created_at": f"2025-08-0{day}T12:00:00+00:00"}
+            )
+
+        response = await client.get(
+            f"/api/characters/{character_id}",
+            params={"include": "locations", "limit": 2,
+                    "start": "2025-08-02T00:00:00+00:00"})
+
+        assert response.status_code == 200
+        data = response.json()
+
+        assert data["name"] == "Арагорн"
+        assert [location["x"] for location in data["locations"]] == [2.0, 3.0]
+        assert data["locations"][0]["character_id"] == character_id
+        assert data["locations"][0]["created_at"] == "2025-08-02T12:00:00Z"
+
+        next_response = await client.get(
+            f"/api/locations/{character_id}",
+            params={"limit": 2, "cursor": data["next_cursor"]})
+        assert [location["x"] for location
+                in next_response.json()["locations"]] == [4.0]
+
+        fake_id = "00000000-0000-0000-0000-000000000000"
+        response = await client.get(f"/api/characters/{fake_id}",
+                                    params={"include": "locations"})
+        assert response.status_code == 404
+
+    async def test_get_batch_with_locations(self, client: AsyncClient):
+        character_ids = []
+        for name in ("Фродо", "Сэм"):
+            create_response = await client.post(
+                "/api/characters",
+                json={"name": name, "description": "Хоббит"}
+            )
+            character_ids.append(create_response.json()["id"])
+
+        await client.post(
+            "/api/locations",
+            json={"character_id": character_ids[1], "x": 1.0, "y": 1.0,
+                  "created_at": "2025-08-01T12:00:00+00:00"}
+        )
+
+        fake_id = "00000000-0000-0000-0000-000000000000"
+        response = await client.get(
+            "/api/characters/batch",
+            params={"ids": [character_ids[1], fake_id, character_ids[0],
+                            character_ids[1]]})
+
+        assert response.status_code == 200
+        characters = response.json()["characters"]
+
+        assert [character["name"] for character in characters] == \
+            ["Сэм", "Фродо"]
+        assert [location["x"] for location
+                in characters[0]["locations"]] == [1.0]
+        assert characters[0]["next_cursor"] is None
+        assert characters[1]["locations"] == []
+
     async def test_get_all(self, client: AsyncClient):
         await client.post(
             "/api/characters",
@@ -94,6 +178,293 @@ class TestCharacters:
         assert "characters" in data
         assert len(data["characters"]) == 3
 
+    async def test_get_all_paginated(self, client: AsyncClient):
+        for name in ("Фродо", "Сэм", "Мерри", "Пиппин", "Бильбо"):
+            await client.post(
+                "/api/characters",
+                json={"name": name, "description": "Хоббит"}
+            )
+
+        names = []
+        cursor = None
+        while True:
+            params = {"limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = await client.get("/api/characters", params=params)
+
+            assert response.status_code == 200
+            data = response.json()
+
+            assert len(data["characters"]) <= 2
+            names.extend(c["name"] for c in data["characters"])
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+
+        assert names == sorted(["Фродо", "Сэм", "Мерри", "Пиппин", "Бильбо"])
+
+    async def test_get_all_mixed_case(self, client: AsyncClient):
+        # Both backends order by code point whatever the database collation.
+        for name in ("арагорн", "Боромир", "aragorn", "Zed", "боромир"):
+            await client.post(
+                "/api/characters",
+                json={"name": name, "description": "Спутник"}
+            )
+
+        names = []
+        cursor = None
+        while True:
+            params = {"limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = await client.get("/api/characters", params=params)
+            data = response.json()
+            names.extend(c["name"] for c in data["characters"])
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+
+        assert names == ["Zed", "aragorn", "Боромир", "арагорн", "боромир"]
+
+    async def test_get_all_invalid_cursor(self, client: AsyncClient):
+        response = await client.get(
+            "/api/characters", params={"cursor": "invalid"})
+
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid cursor"
+
+    async def test_get_all_not_modified(self, client: AsyncClient):
+        await client.post(
+            "/api/characters",
+            json={"name": "Фродо", "description": "Хоббит"}
+        )
+
+        response = await client.get("/api/characters")
+        etag = response.headers["etag"]
+
+        assert response.headers["cache-control"] == "no-cache"
+        assert "last-modified" in response.headers
+
+        cached_response = await client.get(
+            "/api/characters", headers={"If-None-Match": etag})
+
+        assert cached_response.status_code == 304
+        assert cached_response.content == b""
+
+        await client.post(
+            "/api/characters",
+            json={"name": "Сэм", "description": "Хоббит"}
+        )
+
+        changed_response = await client.get(
+            "/api/characters", headers={"If-None-Match": etag})
+
+        assert changed_response.status_code == 200
+        assert len(changed_response.json()["characters"]) == 2
+        assert changed_response.headers["etag"] != etag
+
+    async def test_get_positions(self, client: AsyncClient):
+        create_response = await client.post(
+            "/api/characters",
+            json={"name": "Леголас", "description": "Эльф"}
+        )
+        character_id = create_response.json()["id"]
+
+        location_ids = {}
+        for day, x in ((3, 3.0), (1, 1.0), (2, 2.0)):
+            loc_response = await client.post(
+                "/api/locations",
+                json={"character_id": character_id, "x": x, "y": x,
+                      "created_at": f"2025-08-0{day}T12:00:00+00:00"}
+            )
+            location_ids[x] = loc_response.json()["id"]
+
+        response = await client.get("/api/characters/positions")
+
+        assert response.status_code == 200
+        positions = response.json()["positions"]
+
+        assert len(positions) == 1
+        assert positions[0]["character_id"] == character_id
+        assert positions[0]["x"] == 3.0
+
+        await client.delete(f"/api/locations/{location_ids[3.0]}")
+
+        response = await client.get("/api/characters/positions")
+        assert response.json()["positions"][0]["x"] == 2.0
+
+        await client.delete(f"/api/characters/{character_id}")
+
+        response = await client.get("/api/characters/positions")
+        assert response.json()["positions"] == []
+
+    async def test_get_positions_batch(self, client: AsyncClient):
+        character_ids = []
+        for name in ("Леголас", "Гимли"):
+            create_response = await client.post(
+                "/api/characters",
+                json={"name": name, "description": None}
+            )
+            character_ids.append(create_response.json()["id"])
+
+        await client.post(
+            "/api/locations/batch",
+            json={"locations": [
+                {"character_id": id, "x": x, "y": x,
+                 "created_at": f"2025-08-0{day}T12:00:00+00:00"}
+                for id in character_ids
+                for day, x in ((2, 2.0), (3, 3.0), (1, 1.0))
+            ]}
+        )
+
+        response = await client.get("/api/characters/positions")
+        positions = response.json()["positions"]
+        assert sorted((position["character_id"], position["x"])
+                      for position in positions) == \
+            sorted((id, 3.0) for id in character_ids)
+
+    async def test_search(self, client: AsyncClient):
+        for name in ("Фродо Бэггинс", "Фрея", "Gandalf", "Galadriel", "Сэм"):
+            await client.post("/api/characters",
+                              json={"name": name, "description": None})
+
+        response = await client.get("/api/characters/search",
+                                    params={"q": "Фр"})
+        assert response.status_code == 200
+        assert [character["name"] for character
+                in response.json()["characters"]] == ["Фрея", "Фродо Бэггинс"]
+
+        response = await client.get("/api/characters/search",
+                                    params={"q": "фр"})
+        assert [character["name"] for character
+                in response.json()["characters"]] == ["Фрея", "Фродо Бэггинс"]
+
+        response = await client.get("/api/characters/search",
+                                    params={"q": "GA"})
+        assert [character["name"] for character
+                in response.json()["characters"]] == ["Galadriel", "Gandalf"]
+
+        response = await client.get("/api/characters/search",
+                                    params={"q": "ga", "limit": 1})
+        assert [character["name"] for character
+                in response.json()["characters"]] == ["Galadriel"]
+
+        response = await client.get("/api/characters/search",
+                                    params={"q": "Арагорн"})
+        assert response.json()["characters"] == []
+
+        response = await client.get("/api/characters/search",
+                                    params={"q": ""})
+        assert response.status_code == 422
+
+    async def test_search_typos(self, client: AsyncClient):
+        if Storage.backend == "postgres":
+            async with Postgres.acquire() as conn:
+                if not await conn.fetchval(
+                        "SELECT to_regclass('characters_name_trgm_idx') "
+                        "IS NOT NULL"):
+                    if os.getenv("CI"):
+                        pytest.fail("pg_trgm is required in CI")
+                    pytest.skip("pg_trgm is not installed")
+
+        for name in ("Фродо Бэггинс", "Сэмуайз Гэмджи", "Семуайз", "Арагорн"):
+            await client.post("/api/characters",
+                              json={"name": name, "description": None})
+
+        response = await client.get("/api/characters/search",
+                                    params={"q": "Бэгинс"})
+        assert [character["name"] for character
+                in response.json()["characters"]] == ["Фродо Бэггинс"]
+
+        response = await client.get("/api/characters/search",
+                                    params={"q": "Сэмуайз"})
+        assert [character["name"] for character
+                in response.json()["characters"]] == \
+            ["Сэмуайз Гэмджи", "Семуайз"]
+
+    async def test_get_stats(self, client: AsyncClient):
+        character_ids = []
+        for name in ("Арагорн", "Боромир"):
+            create_response = await client.post(
+                "/api/characters",
+                json={"name": name, "description": "Человек"}
+            )
+            character_ids.append(create_response.json()["id"])
+        character_id, idle_id = character_ids
+
+        for x, y, created_at in ((0.0, 0.0, "2025-08-01T12:00:00+00:00"),
+                                 (3.0, 4.0, "2025-08-01T12:00:10+00:00"),
+                                 (6.0, 8.0, "2025-08-02T12:00:10+00:00")):
+            await client.post(
+                "/api/locations",
+                json={"character_id": character_id, "x": x, "y": y,
+                      "created_at": created_at}
+            )
+
+        response = await client.get(f"/api/characters/{character_id}/stats")
+
+        assert response.status_code == 200
+        stats = response.json()
+        assert stats["character_id"] == character_id
+        assert stats["points"] == 3
+        assert stats["distance"] == pytest.approx(10.0)
+        assert stats["average_speed"] == pytest.approx(10.0 / 86410)
+        assert stats["max_speed"] == pytest.approx(0.5)
+        assert [stats[key] for key in ("x_min", "y_min", "x_max", "y_max")] \
+            == [0.0, 0.0, 6.0, 8.0]
+        assert stats["first_at"] == "2025-08-01T12:00:00Z"
+        assert stats["last_at"] == "2025-08-02T12:00:10Z"
+        assert stats["buckets"] == [
+            {"start": "2025-08-01T00:00:00Z", "points": 2, "distance": 5.0},
+            {"start": "2025-08-02T00:00:00Z", "points": 1, "distance": 5.0},
+        ]
+
+        response = await client.get(
+            f"/api/characters/{character_id}/stats",
+            params={"start": "2025-08-01T12:00:05+00:00", "bucket": "week"})
+        stats = response.json()
+        assert stats["points"] == 2
+        assert stats["distance"] == pytest.approx(5.0)
+        assert stats["max_speed"] == pytest.approx(5.0 / 86400)
+        assert stats["buckets"] == [
+            {"start": "2025-07-28T00:00:00Z", "points": 2, "distance": 5.0},
+        ]
+
+        response = await client.get(f"/api/characters/{idle_id}/stats")
+        assert response.json()["points"] == 0
+        assert response.json()["buckets"] == []
+
+        response = await client.get("/api/characters/stats",
+                                    params={"bucket": "month"})
+        assert response.status_code == 200
+        stats = {item["character_id"]: item
+                 for item in response.json()["stats"]}
+        assert list(stats) == sorted(character_ids)
+        assert stats[character_id]["buckets"] == [
+            {"start": "2025-08-01T00:00:00Z", "points": 3, "distance": 10.0},
+        ]
+        assert stats[idle_id] == (await client.get(
+            f"/api/characters/{idle_id}/stats")).json()
+        assert response.json()["next_cursor"] is None
+
+        pages = []
+        cursor = None
+        while True:
+            params = {"limit": 1, **({"cursor": cursor} if cursor else {})}
+            data = (await client.get("/api/characters/stats",
+                                     params=params)).json()
+            pages.append([item["character_id"] for item in data["stats"]])
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+        assert pages == [[id] for id in sorted(character_ids)]
+
+    async def test_get_stats_not_found(self, client: AsyncClient):
+        response = await client.get(
+            "/api/characters/550e8400-e29b-41d4-a716-446655440000/stats")
+        assert response.status_code == 404
+
     async def test_update(self, client: AsyncClient):
         create_response = await client.post(
             "/api/characters",
@@ -120,6 +491,147 @@ class TestCharacters:
         assert data["name"] == "Гимли сын Глоина"
         assert data["description"] == "Гном, воин Братства Кольца"
 
+    async def test_update_then_get(self, client: AsyncClient):
+        create_response = await client.post(
+            "/api/characters",
+            json={
+                "name": "Гэндальф Серый",
+                "description": "Маг"
+            }
+        )
+
+        character_id = create_response.json()["id"]
+
+        await client.get(f"/api/characters/{character_id}")
+        await client.put(
+            f"/api/characters/{character_id}",
+            json={
+                "name": "Гэндальф Белый",
+                "description": "Маг"
+            }
+        )
+
+        response = await client.get(f"/api/characters/{character_id}")
+        assert response.json()["name"] == "Гэндальф Белый"
+
+        response = await client.post(
+            "/api/characters",
+            json={
+                "name": "Гэндальф Серый",
+                "description": "Маг"
+            }
+        )
+        assert response.status_code == 200
+
+    async def test_update_duplicate_name(self, client: AsyncClient):
+        await client.post(
+            "/api/characters",
+            json={"name": "Саруман", "description": "Белый маг"}
+        )
+        create_response = await client.post(
+            "/api/characters",
+            json={"name": "Радагаст", "description": "Бурый маг"}
+        )
+
+        character_id = create_response.json()["id"]
+
+        response = await client.put(
+            f"/api/characters/{character_id}",
+            json={"name": "Саруман", "description": "Бурый маг"}
+        )
+
+        assert response.status_code == 409
+        assert response.json()["detail"] == "Name already exists"
+
+    @pytest.mark.parametrize("client", ["postgres"], indirect=True)
+    async def test_cache_invalidated_by_other_workers(self,
+                                                      client: AsyncClient):
+        create_response = await client.post(
+            "/api/characters",
+            json={"name": "Радагаст", "description": "Бурый маг"}
+        )
+        character_id = create_response.json()["id"]
+
+        async def wait_for(status_code: int, name: str = None):
+            for _ in range(50):
+                response = await client.get(
+                    f"/api/characters/{character_id}")
+                if response.status_code == status_code and \
+                        (name is None or response.json()["name"] == name):
+                    return
+                await asyncio.sleep(0.02)
+            raise AssertionError("Cached character was not invalidated")
+
+        # Another worker's writes reach this one only as notifications.
+        conn = await asyncpg.connect(os.environ["POSTGRES_URL"])
+        try:
+            await conn.execute(
+                "UPDATE characters SET name = 'Саруман' WHERE id = $1",
+                UUID(character_id))
+            await wait_for(200, "Саруман")
+
+            # name_folded follows renames and inserts made in SQL.
+            await conn.execute(
+                "INSERT INTO characters (id, name, created_at) "
+                "VALUES ($1, 'Сарумана тень', now())", uuid4())
+            response = await client.get("/api/characters/search",
+                                        params={"q": "сарум"})
+            assert [character["name"] for character
+                    in response.json()["characters"]] == \
+                ["Саруман", "Сарумана тень"]
+
+            await conn.execute("DELETE FROM characters WHERE id = $1",
+                               UUID(character_id))
+            await wait_for(404)
+        finally:
+            await conn.close()
+
+        response = await client.post(
+            "/api/locations",
+            json={"character_id": character_id, "x": 1.0, "y": 1.0,
+                  "created_at": "2025-08-01T12:00:00+00:00"}
+        )
+        assert response.status_code == 404
+
+    @pytest.mark.parametrize("client", ["postgres"], indirect=True)
+    async def test_cache_not_refilled_from_lagging_replica(
+            self, client: AsyncClient, monkeypatch):
+        create_response = await client.post(
+            "/api/characters",
+            json={"name": "Радагаст", "description": "Бурый маг"}
+        )
+        character_id = UUID(create_response.json()["id"])
+
+        # The replica sees a snapshot taken before the update below.
+        conn = await asyncpg.connect(os.environ["POSTGRES_URL"])
+        await conn.execute("CREATE SCHEMA lagging; CREATE TABLE "
+                           "lagging.characters AS TABLE characters")
+        replica = await asyncpg.create_pool(
+            os.environ["POSTGRES_URL"], min_size=1, max_size=1,
+            server_settings={"search_path": "lagging, public"})
+        monkeypatch.setattr(Postgres, "_replica", replica)
+
+        async def get_name():
+            # A new request, which has not written to the primary.
+            character = await asyncio.create_task(
+                Storage.characters.get_by_id(character_id),
+                context=contextvars.Context())
+            return character.name
+
+        try:
+            await conn.execute(
+                "UPDATE characters SET name = 'Саруман' WHERE id = $1",
+                character_id)
+            for _ in range(50):
+                if await get_name() == "Саруман":
+                    break
+                await asyncio.sleep(0.02)
+            assert await get_name() == "Саруман"
+        finally:
+            await replica.close()
+            await conn.execute("DROP SCHEMA lagging CASCADE")
+            await conn.close()
+
     async def test_update_not_found(self, client: AsyncClient):
         fake_id = "00000000-0000-0000-0000-000000000000"
         response = await client.put(
@@ -151,6 +663,27 @@ class TestCharacters:
         get_response = await client.get(f"/api/characters/{character_id}")
         assert get_response.status_code == 404
 
+    async def test_delete_cascades_locations(self, client: AsyncClient):
+        create_response = await client.post(
+            "/api/characters",
+            json={"name": "Боромир", "description": "Воин Гондора"}
+        )
+        character_id = create_response.json()["id"]
+
+        await client.post(
+            "/api/locations",
+            json={"character_id": character_id, "x": 1.0, "y": 1.0,
+                  "created_at": "2025-08-01T12:00:00+00:00"}
+        )
+
+        await client.delete(f"/api/characters/{character_id}")
+
+        response = await client.get(
+            "/api/locations/within",
+            params={"x_min": 0, "y_min": 0, "x_max": 2, "y_max": 2}
+        )
+        assert response.json()["locations"] == []
+
     async def test_delete_not_found(self, client: AsyncClient):
         fake_id = "00000000-0000-0000-0000-000000000000"
         response = await client.delete(f"/api/characters/{fake_id}")
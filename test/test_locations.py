@@ -1,9 +1,18 @@
+import asyncio
+import json
+import msgpack
+import numpy as np
 import pytest
 
-from datetime import datetime
-from uuid import UUID
+from datetime import datetime, timezone
+from uuid import UUID, uuid4
 from httpx import AsyncClient
 
+from src.database.postgres import Postgres
+from src.storage.backend import Storage
+from src.storage.base import Location
+from src.storage.buffer import LocationsBuffer
+
 
 @pytest.mark.asyncio
 class TestLocations:
@@ -39,6 +48,146 @@ class TestLocations:
 
         UUID(data["id"])
 
+    @pytest.mark.parametrize("mode", ["flush", "enqueue"])
+    async def test_create_buffered(self, client: AsyncClient, monkeypatch,
+                                   mode: str):
+        char_response = await client.post(
+            "/api/characters",
+            json={"name": "Фродо", "description": "Хоббит"}
+        )
+        character_id = char_response.json()["id"]
+
+        monkeypatch.setenv("LOCATIONS_BUFFER", mode)
+        monkeypatch.setenv("LOCATIONS_BUFFER_ROWS", "8")
+        monkeypatch.setenv("LOCATIONS_BUFFER_SIZE", "8")
+        await LocationsBuffer.start()
+        try:
+            responses = await asyncio.gather(*(
+                client.post(
+                    "/api/locations",
+                    json={"character_id": character_id, "x": i, "y": i,
+                          "created_at": f"2025-08-01T12:{i:02}:00+00:00"}
+                )
+                for i in range(20)
+            ))
+        finally:
+            await LocationsBuffer.stop()
+
+        assert [response.status_code for response in responses] == [200] * 20
+
+        response = await client.get(f"/api/locations/{character_id}")
+        data = response.json()
+        assert [item["x"] for item in data["locations"]] == list(range(20))
+        assert {item["id"] for item in data["locations"]} == \
+            {response.json()["id"] for response in responses}
+
+    async def test_create_buffered_storage_down(self, client: AsyncClient,
+                                                monkeypatch):
+        char_response = await client.post(
+            "/api/characters",
+            json={"name": "Фродо", "description": "Хоббит"}
+        )
+        character_id = UUID(char_response.json()["id"])
+
+        writes = []
+
+        async def create_many(locations):
+            writes.append(len(locations))
+            raise ConnectionError("Database is down")
+
+        monkeypatch.setattr(Storage.locations, "create_many", create_many)
+        monkeypatch.setenv("LOCATIONS_BUFFER", "flush")
+        monkeypatch.setenv("LOCATIONS_BUFFER_ROWS", "8")
+        await LocationsBuffer.start()
+        try:
+            results = await asyncio.gather(*(
+                LocationsBuffer.add(Location(
+                    id=uuid4(), character_id=character_id, x=i, y=i,
+                    created_at=datetime.now(timezone.utc)))
+                for i in range(8)
+            ), return_exceptions=True)
+        finally:
+            await LocationsBuffer.stop()
+
+        # The batch fails at once instead of row by row.
+        assert writes == [8]
+        assert all(isinstance(result, ConnectionError) for result in results)
+
+    async def test_create_batch(self, client: AsyncClient):
+        char_response = await client.post(
+            "/api/characters",
+            json={
+                "name": "Бильбо",
+                "description": "Хоббит"
+            }
+        )
+
+        character_id = char_response.json()["id"]
+        fake_id = "00000000-0000-0000-0000-000000000000"
+
+        response = await client.post(
+            "/api/locations/batch",
+            json={"locations": [
+                {"character_id": character_id, "x": 1.0, "y": 1.0,
+                 "created_at": datetime.now().isoformat()},
+                {"character_id": fake_id, "x": 2.0, "y": 2.0,
+                 "created_at": datetime.now().isoformat()},
+                {"character_id": character_id, "x": 3.0, "y": 3.0,
+                 "created_at": datetime.now().isoformat()}
+            ]}
+        )
+
+        assert response.status_code == 200
+        results = response.json()["results"]
+
+        assert results[0]["location"]["x"] == 1.0
+        assert results[1]["location"] is None
+        assert results[1]["detail"] == "Character not found"
+        assert results[2]["location"]["x"] == 3.0
+
+        get_response = await client.get(f"/api/locations/{character_id}")
+        assert len(get_response.json()["locations"]) == 2
+
+    async def test_create_batch_character_deleted(self, client: AsyncClient,
+                                                  monkeypatch):
+        character_ids = []
+        for name in ("Бильбо", "Фродо"):
+            char_response = await client.post(
+                "/api/characters",
+                json={"name": name, "description": "Хоббит"}
+            )
+            character_ids.append(char_response.json()["id"])
+        character_id, deleted_id = character_ids
+
+        get_existing_ids = Storage.characters.get_existing_ids
+
+        async def deleted_after_check(ids):
+            existing_ids = await get_existing_ids(ids)
+            monkeypatch.setattr(Storage.characters, "get_existing_ids",
+                                get_existing_ids)
+            await client.delete(f"/api/characters/{deleted_id}")
+            return existing_ids
+
+        monkeypatch.setattr(Storage.characters, "get_existing_ids",
+                            deleted_after_check)
+
+        response = await client.post(
+            "/api/locations/batch",
+            json={"locations": [
+                {"character_id": id, "x": x, "y": x,
+                 "created_at": datetime.now().isoformat()}
+                for id, x in ((character_id, 1.0), (deleted_id, 2.0))
+            ]}
+        )
+
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert results[0]["location"]["x"] == 1.0
+        assert results[1]["detail"] == "Character not found"
+
+        get_response = await client.get(f"/api/locations/{character_id}")
+        assert len(get_response.json()["locations"]) == 1
+
     async def test_create_character_not_found(self, client: AsyncClient):
         fake_id = "00000000-0000-0000-0000-000000000000"
         response = await client.post(
@@ -89,6 +238,489 @@ class TestLocations:
         assert "locations" in data
         assert len(data["locations"]) == 3
 
+    async def test_get_by_period(self, client: AsyncClient):
+        char_response = await client.post(
+            "/api/characters",
+            json={
+                "name": "Гэндальф",
+                "description": "Маг"
+            }
+        )
+
+        character_id = char_response.json()["id"]
+
+        for day in (1, 2, 3, 4):
+            await client.post(
+                "/api/locations",
+                json={"character_id": character_id, "x": day, "y": day,
+                      "created_at": f"2025-08-0{day}T12:00:00+00:00"}
+            )
+
+        response = await client.get(
+            f"/api/locations/{character_id}",
+            params={"start": "2025-08-02T00:00:00+00:00",
+                    "end": "2025-08-03T23:59:59+00:00"}
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+
+        assert [loc["x"] for loc in data["locations"]] == [2.0, 3.0]
+
+    async def test_get_paginated(self, client: AsyncClient):
+        char_response = await client.post(
+            "/api/characters",
+            json={
+                "name": "Сэм",
+                "description": "Садовник"
+            }
+        )
+
+        character_id = char_response.json()["id"]
+
+        created_at = "2025-08-01T12:00:00+00:00"
+        for x in range(5):
+            await client.post(
+                "/api/locations",
+                json={"character_id": character_id, "x": x, "y": x,
+                      "created_at": created_at}
+            )
+
+        ids = []
+        cursor = None
+        while True:
+            params = {"limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = await client.get(
+                f"/api/locations/{character_id}", params=params)
+
+            assert response.status_code == 200
+            data = response.json()
+
+            assert len(data["locations"]) <= 2
+            ids.extend(loc["id"] for loc in data["locations"])
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+
+        assert len(ids) == 5
+        assert ids == sorted(ids)
+
+    async def test_get_not_modified(self, client: AsyncClient):
+        character_ids = []
+        for name in ("Сэм", "Фродо"):
+            char_response = await client.post(
+                "/api/characters",
+                json={"name": name, "description": "Хоббит"}
+            )
+            character_ids.append(char_response.json()["id"])
+
+        character_id, other_id = character_ids
+        loc_response = await client.post(
+            "/api/locations",
+            json={"character_id": character_id, "x": 1.0, "y": 1.0,
+                  "created_at": "2025-08-01T12:00:00+00:00"}
+        )
+
+        response = await client.get(f"/api/locations/{character_id}")
+        etag = response.headers["etag"]
+
+        page_response = await client.get(
+            f"/api/locations/{character_id}", params={"limit": 1},
+            headers={"If-None-Match": etag})
+        assert page_response.status_code == 200
+
+        await client.post(
+            "/api/locations",
+            json={"character_id": other_id, "x": 2.0, "y": 2.0,
+                  "created_at": "2025-08-01T12:00:00+00:00"}
+        )
+
+        cached_response = await client.get(
+            f"/api/locations/{character_id}",
+            headers={"If-None-Match": etag})
+        assert cached_response.status_code == 304
+
+        await client.delete(f"/api/locations/{loc_response.json()['id']}")
+
+        changed_response = await client.get(
+            f"/api/locations/{character_id}",
+            headers={"If-None-Match": etag})
+        assert changed_response.status_code == 200
+        assert changed_response.json()["locations"] == []
+
+    async def test_get_msgpack(self, client: AsyncClient):
+        char_response = await client.post(
+            "/api/characters",
+            json={"name": "Сэм", "description": "Садовник"}
+        )
+        character_id = char_response.json()["id"]
+
+        for second in range(3):
+            await client.post(
+                "/api/locations",
+                json={"character_id": character_id, "x": second + 0.5,
+                      "y": -second,
+                      "created_at": f"2025-08-01T12:00:0{second}+00:00"}
+            )
+
+        json_response = await client.get(
+            f"/api/locations/{character_id}", params={"limit": 2})
+        response = await client.get(
+            f"/api/locations/{character_id}", params={"limit": 2},
+            headers={"Accept": "application/x-msgpack"})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-msgpack"
+        assert response.headers["etag"] != json_response.headers["etag"]
+        data = msgpack.unpackb(response.content)
+
+        locations = json_response.json()["locations"]
+        assert data["character_id"] == character_id
+        assert data["count"] == 2
+        assert data["next_cursor"] == json_response.json()["next_cursor"]
+        assert np.frombuffer(data["x"], "<f8").tolist() == \
+            [location["x"] for location in locations]
+        assert np.frombuffer(data["y"], "<f8").tolist() == \
+            [location["y"] for location in locations]
+        assert np.frombuffer(data["created_at"], "<i8").tolist() == [
+            int(datetime.fromisoformat(location["created_at"]).timestamp())
+            * 1_000_000 for location in locations]
+
+        default_response = await client.get(
+            f"/api/locations/{character_id}",
+            headers={"Accept": "application/x-msgpack;q=0.5, "
+                               "application/json"})
+        assert default_response.headers["content-type"] == \
+            "application/json"
+
+    @pytest.mark.parametrize("client", ["postgres"], indirect=True)
+    async def test_partitions(self, client: AsyncClient):
+        char_response = await client.post(
+            "/api/characters",
+            json={"name": "Голлум", "description": "Хоббит"}
+        )
+        character_id = char_response.json()["id"]
+
+        # Both land in the default partition, no months are created yet.
+        for created_at in ("2001-01-15T12:00:00+00:00",
+                           "2031-05-15T12:00:00+00:00"):
+            await client.post(
+                "/api/locations",
+                json={"character_id": character_id, "x": 1.0, "y": 1.0,
+                      "created_at": created_at}
+            )
+
+        async with Postgres.acquire() as conn:
+            try:
+                for month in (datetime(2001, 1, 1, tzinfo=timezone.utc),
+                              datetime(2031, 5, 1, tzinfo=timezone.utc)):
+                    assert await conn.fetchval(
+                        "SELECT create_locations_partition($1)", month)
+
+                partitions = await conn.fetch(
+                    "SELECT tableoid::regclass::text AS partition "
+                    "FROM locations ORDER BY created_at")
+                assert [row["partition"] for row in partitions] == \
+                    ["locations_p2001_01", "locations_p2031_05"]
+
+                response = await client.get(f"/api/locations/{character_id}")
+                etag = response.headers["ETag"]
+                assert len(response.json()["locations"]) == 2
+
+                assert await conn.fetchval(
+                    "SELECT drop_locations_partitions($1)",
+                    datetime(2001, 2, 1, tzinfo=timezone.utc)) == 1
+                assert await conn.fetchval(
+                    "SELECT to_regclass('locations_p2001_01')") is None
+
+                response = await client.get(
+                    f"/api/locations/{character_id}",
+                    headers={"If-None-Match": etag})
+                assert response.status_code == 200
+                assert [location["created_at"] for location
+                        in response.json()["locations"]] == \
+                    ["2031-05-15T12:00:00Z"]
+            finally:
+                await conn.execute("DROP TABLE IF EXISTS locations_p2001_01, "
+                                   "locations_p2031_05")
+
+    async def test_stream(self, client: AsyncClient, stream):
+        character_ids = []
+        for name in ("Сэм", "Фродо"):
+            char_response = await client.post(
+                "/api/characters",
+                json={"name": name, "description": "Хоббит"}
+            )
+            character_ids.append(char_response.json()["id"])
+
+        character_id, other_id = character_ids
+        async with stream(f"/api/locations/{character_id}/stream") as read:
+            assert await read() == 200
+
+            for id, x in ((other_id, 1.0), (character_id, 2.0)):
+                await client.post(
+                    "/api/locations",
+                    json={"character_id": id, "x": x, "y": x,
+                          "created_at": "2025-08-01T12:00:00+00:00"}
+                )
+
+            event = (await read()).decode()
+
+        lines = event.strip().split("\n")
+        assert lines[1] == "event: location"
+        location = json.loads(lines[2].removeprefix("data: "))
+        assert lines[0] == f"id: {location['id']}"
+        assert location["character_id"] == character_id
+        assert location["x"] == 2.0
+        assert location["created_at"] == "2025-08-01T12:00:00Z"
+
+    async def test_stream_all(self, client: AsyncClient, stream):
+        char_response = await client.post(
+            "/api/characters",
+            json={"name": "Сэм", "description": "Хоббит"}
+        )
+        character_id = char_response.json()["id"]
+
+        async with stream("/api/locations/stream") as read:
+            assert await read() == 200
+
+            # More than one notification of the Postgres trigger.
+            await client.post(
+                "/api/locations/batch",
+                json={"locations": [
+                    {"character_id": character_id, "x": x, "y": x,
+                     "created_at": "2025-08-01T12:00:00+00:00"}
+                    for x in range(40)
+                ]}
+            )
+
+            events = ""
+            while events.count("event: location") < 40:
+                events += (await read()).decode()
+
+        assert events.count("event: location") == 40
+
+    async def test_stream_character_not_found(self, client: AsyncClient):
+        fake_id = "00000000-0000-0000-0000-000000000000"
+        response = await client.get(f"/api/locations/{fake_id}/stream")
+
+        assert response.status_code == 404
+
+    async def test_get_simplified(self, client: AsyncClient):
+        char_response = await client.post(
+            "/api/characters",
+            json={
+                "name": "Мерри",
+                "description": "Хоббит"
+            }
+        )
+
+        character_id = char_response.json()["id"]
+
+        await client.post(
+            "/api/locations/batch",
+            json={"locations": [
+                {"character_id": character_id, "x": x, "y": 10 - abs(x - 10),
+                 "created_at": f"2025-08-01T12:00:{x:02}+00:00"}
+                for x in range(21)
+            ]}
+        )
+
+        response = await client.get(
+            f"/api/locations/{character_id}", params={"max_points": 2})
+
+        assert response.status_code == 200
+        data = response.json()
+
+        assert [loc["x"] for loc in data["locations"]] == [0, 20]
+        assert data["next_cursor"] is None
+
+        response = await client.get(
+            f"/api/locations/{character_id}", params={"tolerance": 0.1})
+
+        assert [loc["x"] for loc in response.json()["locations"]] == \
+            [0, 10, 20]
+
+    async def test_get_track_reduced(self, client: AsyncClient):
+        char_response = await client.post(
+            "/api/characters",
+            json={"name": "Мерри", "description": "Хоббит"}
+        )
+        character_id = char_response.json()["id"]
+
+        await client.post(
+            "/api/locations/batch",
+            json={"locations": [
+                {"character_id": character_id, "x": x, "y": 10 - abs(x - 10),
+                 "created_at": f"2025-08-01T12:00:{x:02}+00:00"}
+                for x in range(21)
+            ]}
+        )
+
+        # Four 5 second buckets, each giving the location nearest to its
+        # mean position, and both ends of the track.
+        rows = await Storage.locations.get_track(
+            UUID(character_id), max_rows=4)
+        assert [row["x"] for row in rows] == [0, 2, 7, 12, 17, 20]
+
+        rows = await Storage.locations.get_track(
+            UUID(character_id), max_rows=21)
+        assert len(rows) == 21
+
+    async def test_export(self, client: AsyncClient):
+        char_response = await client.post(
+            "/api/characters",
+            json={
+                "name": "Пиппин",
+                "description": "Хоббит"
+            }
+        )
+
+        character_id = char_response.json()["id"]
+
+        for day in (1, 2, 3):
+            await client.post(
+                "/api/locations",
+                json={"character_id": character_id, "x": day, "y": day,
+                      "created_at": f"2025-08-0{day}T12:00:00+00:00"}
+            )
+
+        response = await client.get(
+            f"/api/locations/{character_id}/export",
+            params={"start": "2025-08-02T00:00:00+00:00"}
+        )
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+
+        rows = [json.loads(line) for line in response.text.splitlines()]
+
+        assert [row["x"] for row in rows] == [2.0, 3.0]
+        assert all(row["character_id"] == character_id for row in rows)
+        assert [row["created_at"] for row in rows] == \
+            ["2025-08-02T12:00:00Z", "2025-08-03T12:00:00Z"]
+
+    async def test_export_character_not_found(self, client: AsyncClient):
+        fake_id = "00000000-0000-0000-0000-000000000000"
+        response = await client.get(f"/api/locations/{fake_id}/export")
+
+        assert response.status_code == 404
+        assert response.json()["detail"] == "Character not found"
+
+    async def test_get_within(self, client: AsyncClient):
+        char_response = await client.post(
+            "/api/characters",
+            json={
+                "name": "Гимли",
+                "description": "Гном"
+            }
+        )
+
+        character_id = char_response.json()["id"]
+
+        for x, y in ((1.0, 1.0), (5.0, 5.0), (9.0, 9.0)):
+            await client.post(
+                "/api/locations",
+                json={"character_id": character_id, "x": x, "y": y,
+                      "created_at": datetime.now().isoformat()}
+            )
+
+        response = await client.get(
+            "/api/locations/within",
+            params={"x_min": 0, "y_min": 0, "x_max": 6, "y_max": 6}
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+
+        assert [loc["x"] for loc in data["locations"]] == [1.0, 5.0]
+        assert data["next_cursor"] is None
+
+        params = {"x_min": 0, "y_min": 0, "x_max": 10, "y_max": 10,
+                  "limit": 2}
+        response = await client.get("/api/locations/within", params=params)
+        data = response.json()
+        assert [loc["x"] for loc in data["locations"]] == [1.0, 5.0]
+
+        response = await client.get(
+            "/api/locations/within",
+            params={**params, "cursor": data["next_cursor"]})
+        data = response.json()
+        assert [loc["x"] for loc in data["locations"]] == [9.0]
+        assert data["next_cursor"] is None
+
+    async def test_get_nearest(self, client: AsyncClient):
+        char_response = await client.post(
+            "/api/characters",
+            json={
+                "name": "Боромир",
+                "description": "Воин Гондора"
+            }
+        )
+
+        character_id = char_response.json()["id"]
+
+        for x, y in ((1.0, 1.0), (5.0, 5.0), (9.0, 9.0)):
+            await client.post(
+                "/api/locations",
+                json={"character_id": character_id, "x": x, "y": y,
+                      "created_at": datetime.now().isoformat()}
+            )
+
+        response = await client.get(
+            "/api/locations/nearest", params={"x": 8, "y": 8, "k": 2})
+
+        assert response.status_code == 200
+        data = response.json()
+
+        assert [loc["x"] for loc in data["locations"]] == [9.0, 5.0]
+
+    async def test_get_nearest_spread(self, client: AsyncClient):
+        char_response = await client.post(
+            "/api/characters",
+            json={
+                "name": "Фарамир",
+                "description": "Капитан Гондора"
+            }
+        )
+
+        character_id = char_response.json()["id"]
+        points = [(x * 25.0, y * 25.0)
+                  for x in range(-4, 5) for y in range(-4, 5)]
+        await client.post(
+            "/api/locations/batch",
+            json={"locations": [
+                {"character_id": character_id, "x": x, "y": y,
+                 "created_at": datetime.now().isoformat()}
+                for x, y in points
+            ]}
+        )
+
+        response = await client.get(
+            "/api/locations/nearest", params={"x": 60, "y": -60, "k": 4})
+
+        assert response.status_code == 200
+        assert {(loc["x"], loc["y"]) for loc in
+                response.json()["locations"]} == \
+            {(50.0, -50.0), (50.0, -75.0), (75.0, -50.0), (75.0, -75.0)}
+
+        response = await client.get(
+            "/api/locations/nearest", params={"x": 1000, "y": 1000, "k": 1})
+
+        assert [(loc["x"], loc["y"]) for loc in
+                response.json()["locations"]] == [(100.0, 100.0)]
+
+        response = await client.get(
+            "/api/locations/within",
+            params={"x_min": -30, "y_min": 20, "x_max": 30, "y_max": 60})
+
+        assert sorted((loc["x"], loc["y"]) for loc in
+                      response.json()["locations"]) == \
+            [(-25.0, 25.0), (-25.0, 50.0), (0.0, 25.0), (0.0, 50.0),
+             (25.0, 25.0), (25.0, 50.0)]
+
     async def test_get_character_not_found(self, client: AsyncClient):
         fake_id = "00000000-0000-0000-0000-000000000000"
         response = await client.get(f"/api/locations/{fake_id}")
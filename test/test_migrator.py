@@ -0,0 +1,47 @@
+import asyncio
+import hashlib
+import os
+
+import asyncpg
+import pytest
+
+from migrations.migrator import main
+
+
+@pytest.mark.asyncio
+class TestMigrator:
+    async def test_data_migration(self, tmp_path, monkeypatch):
+        files = {
+            "001_added_migrator_test.sql":
+                "CREATE TABLE migrator_test (id INT PRIMARY KEY, name TEXT);",
+            "002_added_migrator_test_data.migrator_test.csv":
+                "name,id\nФродо,1\n\"Сэм, садовник\",2\n",
+        }
+        for name, content in files.items():
+            (tmp_path / name).write_text(content, encoding="utf-8")
+        monkeypatch.setenv("MIGRATIONS_DIR", str(tmp_path))
+
+        conn = await asyncpg.connect(os.environ["POSTGRES_URL"])
+        try:
+            # The second run waits for the lock and applies nothing.
+            await asyncio.gather(main(), main())
+
+            rows = await conn.fetch(
+                "SELECT id, name FROM migrator_test ORDER BY id")
+            assert [tuple(row) for row in rows] == \
+                [(1, "Фродо"), (2, "Сэм, садовник")]
+
+            rows = await conn.fetch(
+                "SELECT name, checksum, duration_ms FROM migrations "
+                "WHERE name = ANY($1::text[]) ORDER BY name", list(files))
+            assert [row["name"] for row in rows] == list(files)
+            for row, content in zip(rows, files.values()):
+                assert row["checksum"] == hashlib.sha256(
+                    content.encode()).hexdigest()
+                assert row["duration_ms"] >= 0
+        finally:
+            await conn.execute("DROP TABLE IF EXISTS migrator_test")
+            await conn.execute(
+                "DELETE FROM migrations WHERE name = ANY($1::text[])",
+                list(files))
+            await conn.close()
@@ -0,0 +1,30 @@
+from src.server import pool_settings
+
+
+class TestServer:
+    def test_pool_budget_split(self):
+        settings = pool_settings(workers=4, budget=24, min_size=2,
+                                 max_size=10)
+
+        # One connection of each worker's share is its listener.
+        assert settings == {"POSTGRES_POOL_MAX_SIZE": "5",
+                            "POSTGRES_POOL_MIN_SIZE": "2"}
+
+    def test_pool_budget_keeps_max_size(self):
+        settings = pool_settings(workers=2, budget=80, min_size=1,
+                                 max_size=10)
+
+        assert settings["POSTGRES_POOL_MAX_SIZE"] == "10"
+
+    def test_pool_budget_caps_min_size(self):
+        settings = pool_settings(workers=3, budget=9, min_size=4,
+                                 max_size=10)
+
+        assert settings == {"POSTGRES_POOL_MAX_SIZE": "2",
+                            "POSTGRES_POOL_MIN_SIZE": "2"}
+
+    def test_pool_budget_smaller_than_workers(self):
+        settings = pool_settings(workers=8, budget=4, min_size=1,
+                                 max_size=10)
+
+        assert settings["POSTGRES_POOL_MAX_SIZE"] == "1"